@@ -1,5 +1,6 @@
 # Librairies import
 import functions as fc
+import numpy as np
 import plotly.express as px
 from plotly.subplots import make_subplots
 import plotly.graph_objects as go
@@ -14,7 +15,9 @@ st.set_page_config(
 )
 
 ### Data filter and preparation
-df_data, df_unit = fc.import_data_fit("data.fit")
+df_data, df_unit, df_tables = fc.import_data_fit("data.fit", side_tables=True)
+# Laps, events and session summary of the watch
+df_laps, df_events, df_session = df_tables['lap'], df_tables['event'], df_tables['session']
 # Unit recuperation
 df_unit = df_unit.iloc[0]
 
@@ -39,7 +42,9 @@ df_data['position_long'] = df_data['position_long']*(180/2**31)
 m = fc.mapping_session(df_data, "position_lat", "position_long")
 
 ### Running session stats
-df_stats = fc.all_session_stat(df_data)
+# Session on a uniform 1 s grid (gaps when the watch is off are masked) : the averages are weighted by time
+df_grid = fc.resample_session(df_data, step=1.0)
+df_stats = fc.all_session_stat(df_grid, df_session)
 
 
 # Title of streamlit app
@@ -114,23 +119,14 @@ st.markdown("This session is divided into three parts : warm-up, speed intervals
 "In addition, we also see gaps in activity that may correspond to break zones when the watch turns off.")
 
 # Session parts
-# End of warm-up corresponding to the first time after break of more than 80s
-end_warmup = df_data.index[df_data['delta_time']>80][0]
-# Creation of warm-up dataframe 
-df_warmup = df_data.iloc[:end_warmup]
-# Start of speed interval corresponding to the first row after the end of warm-up
-start_speed_interval = df_warmup.index[-1]+1
-# End of speed interval corresponding to the second time after break of more than 80s
-end_speed_interval = df_data.index[df_data['delta_time']>80][1]
-# Creation of speed interval dataframe
-df_speed_interval = df_data.iloc[start_speed_interval:end_speed_interval]
-# Start of cool-down corresponding to the first row after the end of speed interval
-start_cool_down = df_speed_interval.index[-1]+1
-# Creation of cool-down dataframe (start_cool_down to the end)
-df_cooldown = df_data.iloc[start_cool_down:]
+# Warm-up, speed intervals and cool-down from the workout laps of the watch, else from the first two timer pauses
+# of more than 80s, else from the manual laps (first lap, middle laps, last lap), else from the gaps in the records
+df_warmup, df_speed_interval, df_cooldown = fc.split_session(df_data, df_laps, df_events, gap=fc.WATCH_OFF_GAP)
+# Each part on the uniform 1 s grid for the statistics, the pace and the heart rate zones
+df_warmup, df_speed_interval, df_cooldown = (fc.resample_session(df, step=1.0) for df in (df_warmup, df_speed_interval, df_cooldown))
 
 # Stats per part of the running session
-df_warmup_stat, df_speed_stat, df_cooldown_stat = fc.running_session_stats(df_warmup, df_speed_interval, df_cooldown)
+df_warmup_stat, df_speed_stat, df_cooldown_stat = fc.running_session_stats(df_warmup, df_speed_interval, df_cooldown, df_laps)
 
 # Streamlit display
 st.subheader("Interval statistics")
@@ -199,7 +195,11 @@ st.markdown("The speed interval session consists of 30 seconds of effort followe
 "break and then again 8 speed intervals.")
 
 # Speed interval datas and stats
-threshold = 4.0 # 4 is chosen by me. It is the point where rest speed < 4 and effort speed > 4
+# The threshold is chosen automatically among candidates : the one whose efforts and rests best match the 30/50 s workout
+df_sweep, threshold = fc.threshold_sweep(df_speed_interval, np.arange(3.0, 6.0, 0.1), effort=30, rest=50)
+if threshold is None:
+    st.warning("No speed intervals were found in this session.")
+    st.stop()
 df_intervals_speed, df_intervals_rest = fc.speed_session_stat(df_speed_interval, threshold)
 
 # streamlit for display dataframes
@@ -0,0 +1,197 @@
+import json
+import os
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import pandas as pd
+from fitparse import FitFile
+
+# FIT timestamps are seconds since 1989-12-31 00:00 UTC
+FIT_EPOCH = pd.Timestamp(datetime(1989, 12, 31))
+# Messages needed to resolve developer fields
+DEV_MESSAGES = ('developer_data_id', 'field_description')
+
+# NOTE : fitparse only decodes sequentially. The parser state needed to resume decoding
+# in the middle of a file (position, bytes left, active definition messages, accumulators
+# and compressed timestamp) lives in private attributes of FitFile, which are read and
+# restored here. fitparse is pinned in requirements.txt for this reason, and
+# tests/test_fit_index.py checks the window decodes against import_data_fit.
+
+def _to_fit_time(value) -> float:
+    '''
+    Function that converts a datetime into a FIT timestamp (seconds since FIT epoch)
+    '''
+    return (pd.Timestamp(value) - FIT_EPOCH).total_seconds()
+
+def _index_path(filename: str) -> str:
+    return f"{filename}.idx.json"
+
+def build_fit_index(filename: str, every: int = 100, save: bool = True) -> dict:
+    '''
+    Function that scans a FIT file once and builds an index of checkpoints
+    to decode only part of the file later
+
+    Inputs :
+    - filename : Filename or filepath of the FIT file
+    - every : number of records between two checkpoints
+    - save : write the index in a sidecar file (filename + '.idx.json')
+
+    Output : a dictionnary with, for each checkpoint, the byte offset, the timestamp
+    of the record and the parser state (active definitions, accumulators)
+    '''
+    fitfile = FitFile(filename)
+    # Offset of the active definition message of each local message number
+    definitions = {}
+    # Offsets (definition, data) of the developer data messages
+    developer = []
+    checkpoints = []
+    n_records = 0
+    snapshot = None
+    while fitfile._file is not None:
+        offset = fitfile._file.tell()
+        # Parser state before the next checkpoint record
+        if n_records % every == 0:
+            snapshot = {
+                'offset': offset,
+                'bytes_left': fitfile._bytes_left,
+                'compressed_ts': fitfile._compressed_ts_accumulator,
+                'accumulators': {str(k): {str(d): v for d, v in acc.items()} for k, acc in fitfile._accumulators.items()},
+                'definitions': {str(k): v for k, v in definitions.items()}
+            }
+        message = fitfile._parse_message()
+        if message is None:
+            break
+        # Do not keep the decoded messages in memory
+        fitfile._messages.clear()
+        local_mesg_num = message.header.local_mesg_num
+        if message.type == 'definition':
+            definitions[local_mesg_num] = offset
+        elif message.name in DEV_MESSAGES:
+            developer.append([definitions[local_mesg_num], offset])
+        elif message.name == 'record':
+            timestamp = message.get('timestamp')
+            if n_records % every == 0 and timestamp is not None:
+                snapshot['timestamp'] = timestamp.raw_value
+                checkpoints.append(snapshot)
+            n_records += 1
+
+    stat = os.stat(filename)
+    index = {
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'every': every,
+        'n_records': n_records,
+        'developer': developer,
+        'checkpoints': checkpoints
+    }
+    if save:
+        with open(_index_path(filename), 'w') as f:
+            json.dump(index, f, separators=(',', ':'))
+    return index
+
+def load_fit_index(filename: str, every: int = 100) -> dict:
+    '''
+    Function that loads the sidecar index of a FIT file, or builds it
+    if it does not exist, if the FIT file changed or if it was built with another checkpoint interval
+
+    Inputs :
+    - filename : Filename or filepath of the FIT file
+    - every : number of records between two checkpoints (when the index is built)
+
+    Output : the index dictionnary
+    '''
+    path = _index_path(filename)
+    if os.path.exists(path):
+        with open(path) as f:
+            index = json.load(f)
+        stat = os.stat(filename)
+        if index['size'] == stat.st_size and index['mtime'] == stat.st_mtime and index['every'] == every:
+            return index
+    return build_fit_index(filename, every=every)
+
+def _parse_at(fitfile: FitFile, offset: int):
+    # Parse the single message at the given offset
+    fitfile._file.seek(offset)
+    fitfile._bytes_left = fitfile._filesize
+    return fitfile._parse_message()
+
+def _open_at(filename: str, index: dict, checkpoint: dict) -> FitFile:
+    '''
+    Function that opens a FIT file and restores the parser state of a checkpoint
+    '''
+    # The CRC can't be checked on part of the file
+    fitfile = FitFile(filename, check_crc=False)
+    # Replay the developer data messages and the active definitions
+    for def_offset, data_offset in index['developer']:
+        if data_offset < checkpoint['offset']:
+            _parse_at(fitfile, def_offset)
+            _parse_at(fitfile, data_offset)
+    for offset in checkpoint['definitions'].values():
+        _parse_at(fitfile, offset)
+    # Restore the state (definitions reset the accumulators, so it is done after)
+    fitfile._file.seek(checkpoint['offset'])
+    fitfile._bytes_left = checkpoint['bytes_left']
+    fitfile._compressed_ts_accumulator = checkpoint['compressed_ts']
+    fitfile._accumulators = {int(k): {int(d): v for d, v in acc.items()} for k, acc in checkpoint['accumulators'].items()}
+    fitfile._messages.clear()
+    return fitfile
+
+def import_data_fit_window(filename: str, start, end, index: dict = None):
+    '''
+    Function to transform only a time window of a FIT file in to a dataframe
+
+    Inputs :
+    - filename : Filename or filepath of the FIT file
+    - start, end : bounds of the window (datetime, included)
+    - index : index of the file (loaded or built if None)
+
+    Output : two dataframe, one with datas and the other one with the units (as import_data_fit)
+    '''
+    if index is None:
+        index = load_fit_index(filename)
+    records = []
+    units = []
+    checkpoints = index['checkpoints']
+    if checkpoints:
+        stamps = [c['timestamp'] for c in checkpoints]
+        # Last checkpoint before the start and first checkpoint after the end
+        first = max(bisect_right(stamps, _to_fit_time(start)) - 1, 0)
+        last = bisect_right(stamps, _to_fit_time(end))
+        stop = checkpoints[last]['offset'] if last < len(checkpoints) else None
+        start, end = pd.Timestamp(start), pd.Timestamp(end)
+
+        fitfile = _open_at(filename, index, checkpoints[first])
+        while fitfile._file is not None and (stop is None or fitfile._file.tell() < stop):
+            message = fitfile._parse_message()
+            if message is None:
+                break
+            fitfile._messages.clear()
+            if message.type == 'data' and message.name == 'record':
+                data = {field.name: field.value for field in message}
+                # Keep only the records in the window
+                if data.get('timestamp') is not None and start <= data['timestamp'] <= end:
+                    records.append(data)
+                    units.append({field.name: field.units for field in message})
+        fitfile.close()
+
+    # Creation of the dataframe
+    df_data = pd.DataFrame(records)
+    df_unit = pd.DataFrame(units)
+    return df_data, df_unit
+
+def import_data_fit_windows(filename: str, windows: list, processes: int = None) -> list:
+    '''
+    Function that decodes several time windows of a FIT file in parallel
+
+    Inputs :
+    - filename : Filename or filepath of the FIT file
+    - windows : list of (start, end) tuples
+    - processes : number of worker processes (None for the number of CPUs)
+
+    Output : list of (df_data, df_unit), one per window
+    '''
+    # The index is built once and shared with the workers
+    index = load_fit_index(filename)
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = [pool.submit(import_data_fit_window, filename, start, end, index) for start, end in windows]
+        return [future.result() for future in futures]
@@ -3,19 +3,40 @@ import numpy as np
 from fitparse import FitFile
 import folium
 
-def import_data_fit(filename:str) -> pd.DataFrame:
+# Fields kept in the side tables (laps, events and session summary)
+LAP_FIELDS = ['start_time', 'timestamp', 'total_elapsed_time', 'total_timer_time', 'total_distance',
+              'avg_heart_rate', 'max_heart_rate', 'enhanced_avg_speed', 'enhanced_max_speed',
+              'avg_running_cadence', 'total_ascent', 'total_descent', 'lap_trigger', 'intensity', 'wkt_step_index']
+EVENT_FIELDS = ['timestamp', 'event', 'event_type', 'timer_trigger', 'data']
+SESSION_FIELDS = ['start_time', 'timestamp', 'total_elapsed_time', 'total_timer_time', 'total_distance',
+                  'avg_heart_rate', 'max_heart_rate', 'enhanced_avg_speed', 'enhanced_max_speed',
+                  'avg_running_cadence', 'total_ascent', 'total_descent', 'avg_temperature', 'max_temperature',
+                  'total_calories', 'num_laps', 'sport', 'sub_sport']
+# Time (s) between two records above which the watch is considered off (resampling, parts, load)
+WATCH_OFF_GAP = 80
+
+def import_data_fit(filename:str, side_tables:bool=False) -> pd.DataFrame:
     '''
     Function to transform a FIT file in to a dataframe
 
-    Input : Filename or filepath (here data.fit in our case)
+    Input : 
+    - Filename or filepath (here data.fit in our case)
+    - side_tables : also return the laps, events and session summary of the watch
     Output : two dataframe, one with datas and the other one with the units
+    (+ a dictionnary of dataframes 'lap', 'event' and 'session' if side_tables)
     '''
     fitfile = FitFile(filename)
     # 2 lists to create the dataframe
     records = []
     units = []
-    # loop on each record
-    for record in fitfile.get_messages("record"):
+    # Lists for the side tables
+    messages = {'lap': [], 'event': [], 'session': []}
+    names = ["record"] + list(messages) if side_tables else "record"
+    # loop on each record (and lap, event, session messages in the same pass)
+    for record in fitfile.get_messages(names):
+        if record.name != "record":
+            messages[record.name].append(record.get_values())
+            continue
         # Data and unit dictionnary
         data = {field.name:field.value for field in record}
         unit = {field.name: field.units for field in record}
@@ -32,7 +53,15 @@ def import_data_fit(filename:str) -> pd.DataFrame:
     if isinstance(df_unit, pd.Series):
         df_unit = pd.DataFrame([df_unit])
 
-    return df_data, df_unit
+    if not side_tables:
+        return df_data, df_unit
+    # Compact side tables : only the useful fields
+    fields = {'lap': LAP_FIELDS, 'event': EVENT_FIELDS, 'session': SESSION_FIELDS}
+    tables = {}
+    for name, values in messages.items():
+        df = pd.DataFrame(values)
+        tables[name] = df[[col for col in fields[name] if col in df.columns]]
+    return df_data, df_unit, tables
 
 def mapping_session(df : pd.DataFrame, latitude:str, longitude:str):
     '''
@@ -109,17 +138,243 @@ def format_bin_left(b):
     seconds = int(b.left % 60)
     return f"{minutes}:{seconds:02d}"
 
-def all_session_stat(df : pd.DataFrame):
+def resample_session(df: pd.DataFrame, step: float = 1.0, max_gap: float = WATCH_OFF_GAP) -> pd.DataFrame:
+    '''
+    Function that aligns the records of a session on a uniform time grid
+
+    Inputs :
+    - df : Dataframe of datas
+    - step : time (s) between two points of the grid
+    - max_gap : time (s) between two records above which the watch is considered off
+
+    Output : a dataframe with one row per grid point. Numeric columns are linearly interpolated,
+    the other columns take the value of the previous record. The 'gap' column is True for the
+    points in a gap (values set to NaN / None), 'delta_time' is the time (s) of each point
+    (0 in the gaps), so that means and sums are weighted by time.
+    '''
+    df = df.sort_values('timestamp')
+    t = (df['timestamp'] - df['timestamp'].iloc[0]).dt.total_seconds().to_numpy()
+    grid = np.arange(0, t[-1] + step / 2, step)
+    # Record before and after each grid point
+    before = np.searchsorted(t, grid, side='right') - 1
+    after = np.minimum(before + 1, len(t) - 1)
+    gap = (t[after] - t[before] > max_gap) & (grid > t[before])
+
+    df_grid = pd.DataFrame({'timestamp': df['timestamp'].iloc[0] + pd.to_timedelta(grid, unit='s')})
+    for col in df.columns.drop(['timestamp', 'delta_time', 'time'], errors='ignore'):
+        values = df[col]
+        if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+            values = values.to_numpy(dtype=float)
+            valid = ~np.isnan(values)
+            interp = np.interp(grid, t[valid], values[valid]) if valid.any() else np.full(len(grid), np.nan)
+            df_grid[col] = np.where(gap, np.nan, interp)
+        else:
+            values = pd.Series(values.to_numpy()[before])
+            # Nullable booleans, so that the gaps can be missing values
+            if pd.api.types.is_bool_dtype(values):
+                values = values.astype('boolean')
+            df_grid[col] = values.where(~gap).to_numpy()
+    df_grid['gap'] = gap
+    df_grid['delta_time'] = np.where(gap, 0.0, step)
+    # Time (min), also defined in the gaps : the one of the records if they have it, else from the start
+    df_grid['time'] = np.interp(grid, t, df['time'].to_numpy(dtype=float)) if 'time' in df else grid / 60
+    return df_grid
+
+def time_weighted_mean(values, valid) -> float:
+    '''
+    Function that computes the mean of a column of a uniform grid (each point has the same duration)
+
+    Inputs : values and mask of the valid points (e.g. ~df_grid['gap'])
+    Output : the mean
+    '''
+    values = np.asarray(values, dtype=float)
+    valid = np.asarray(valid, dtype=bool) & ~np.isnan(values)
+    return float(values[valid].mean()) if valid.any() else np.nan
+
+def grid_valid(df: pd.DataFrame) -> np.ndarray:
+    '''
+    Function that returns the mask of the points outside the gaps (all the rows if df is not resampled)
+    '''
+    return ~df['gap'].to_numpy(dtype=bool) if 'gap' in df else np.ones(len(df), dtype=bool)
+
+def rolling_mean(values, valid, window: int) -> np.ndarray:
+    '''
+    Function that computes the trailing rolling mean of a column of a uniform grid
+
+    Inputs : values, mask of the valid points and window (number of grid points)
+    Output : array of the rolling mean (NaN when the window has no valid point)
+    '''
+    values = np.asarray(values, dtype=float)
+    valid = np.asarray(valid, dtype=bool) & ~np.isnan(values)
+    # Cumulative sums of the values and of the number of valid points
+    total = np.concatenate([[0], np.cumsum(np.where(valid, values, 0.0))])
+    count = np.concatenate([[0], np.cumsum(valid)])
+    first = np.maximum(np.arange(1, len(values) + 1) - window, 0)
+    n = count[1:] - count[first]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(n > 0, (total[1:] - total[first]) / n, np.nan)
+
+def rolling_max(values, valid, window: int) -> np.ndarray:
+    '''
+    Function that computes the trailing rolling maximum of a column of a uniform grid
+
+    Inputs : values, mask of the valid points and window (number of grid points)
+    Output : array of the rolling maximum (NaN when the window has no valid point)
+    '''
+    values = np.asarray(values, dtype=float)
+    valid = np.asarray(valid, dtype=bool) & ~np.isnan(values)
+    padded = np.concatenate([np.full(window - 1, -np.inf), np.where(valid, values, -np.inf)])
+    result = np.lib.stride_tricks.sliding_window_view(padded, window).max(axis=1)
+    return np.where(np.isinf(result), np.nan, result)
+
+def cumulative_integral(values, valid, step: float = 1.0) -> np.ndarray:
+    '''
+    Function that computes the cumulative integral over time of a column of a uniform grid
+    (e.g. distance from speed), the gaps are not counted
+
+    Inputs : values, mask of the valid points and step (s) of the grid
+    Output : array of the cumulative integral
+    '''
+    values = np.asarray(values, dtype=float)
+    valid = np.asarray(valid, dtype=bool) & ~np.isnan(values)
+    return np.cumsum(np.where(valid, values, 0.0)) * step
+
+def split_session(df: pd.DataFrame, laps: pd.DataFrame = None, events: pd.DataFrame = None, gap: float = WATCH_OFF_GAP):
+    '''
+    Function that divides the session into warm-up, speed intervals and cool-down
+
+    Inputs :
+    - df : Dataframe of datas sorted by timestamp (with the delta_time column)
+    - laps : lap table of the watch, used only for manual or workout laps (see split_laps)
+    - events : event table of the watch (timer pauses of more than gap seconds between parts)
+    - gap : minimum break (s) between two parts when the laps can't be used
+
+    The bounds are taken from, in this order : the workout laps, the timer pauses, the manual laps
+    (the runner often presses the lap button a bit before or after the pause) and the breaks in the records.
+
+    Outputs : three dataframes (warm-up, speed intervals, cool-down)
+    '''
+    bounds = []
+    # Workout laps : O(laps)
+    _, laps_speed, laps_cooldown = split_laps(laps, manual=False)
+    if laps_speed is not None:
+        bounds = [laps_speed['start_time'].iloc[0], laps_cooldown['start_time'].iloc[0]]
+    # Timer pauses of the watch : O(events)
+    if len(bounds) < 2 and events is not None and len(events) > 0 and 'event' in events:
+        timer = events[events['event'] == 'timer'].sort_values('timestamp')
+        is_stop = timer['event_type'].astype(str).str.startswith('stop')
+        next_start = timer['event_type'].shift(-1) == 'start'
+        pause = timer['timestamp'].shift(-1) - timer['timestamp']
+        # Restart after a long pause
+        restarts = timer['timestamp'].shift(-1)[is_stop & next_start & (pause.dt.total_seconds() > gap)]
+        if len(restarts) >= 2:
+            bounds = restarts.iloc[:2].tolist()
+    # Manual laps : O(laps)
+    if len(bounds) < 2:
+        _, laps_speed, laps_cooldown = split_laps(laps)
+        if laps_speed is not None:
+            bounds = [laps_speed['start_time'].iloc[0], laps_cooldown['start_time'].iloc[0]]
+    # Fallback : scan of the records for breaks of more than gap seconds
+    if len(bounds) < 2:
+        bounds = df.loc[df['delta_time'] > gap, 'timestamp'].iloc[:2].tolist()
+    if len(bounds) < 2:
+        raise ValueError("The session can't be divided into warm-up, speed intervals and cool-down")
+    # Positions of the bounds in the sorted records
+    end_warmup, end_speed_interval = df['timestamp'].searchsorted(bounds)
+    return df.iloc[:end_warmup], df.iloc[end_warmup:end_speed_interval], df.iloc[end_speed_interval:]
+
+# Maximum time (s) between the start of a lap and the first record of a part to use the totals of the lap
+LAP_ALIGNMENT = 10
+# Lap triggers of laps taken by the runner (not automatic laps every km, every x min...)
+MANUAL_LAP_TRIGGERS = ['manual', 'session_end']
+
+def split_laps(laps: pd.DataFrame, manual: bool = True):
+    '''
+    Function that divides the laps of the watch into warm-up, speed intervals and cool-down.
+    Only two kinds of laps describe the parts of the session :
+    - workout laps : laps with intensity 'warmup' at the start and 'cooldown' at the end
+    - manual laps : first lap = warm-up, last lap = cool-down
+
+    Inputs :
+    - laps : lap table of the watch
+    - manual : also use the manual laps (False for the workout laps only)
+
+    Outputs : three lap tables (warm-up, speed intervals, cool-down), None if the laps can't be used
+    (less than three laps, automatic laps)
+    '''
+    if laps is None or len(laps) < 3:
+        return None, None, None
+    # Workout laps : leading warm-up laps and trailing cool-down laps
+    if 'intensity' in laps:
+        intensity = laps['intensity'].astype(str).to_numpy()
+        n_warmup = int(np.argmin(intensity == 'warmup')) if (intensity != 'warmup').any() else len(laps)
+        n_cooldown = int(np.argmin(intensity[::-1] == 'cooldown')) if (intensity != 'cooldown').any() else len(laps)
+        if n_warmup > 0 and n_cooldown > 0 and n_warmup + n_cooldown < len(laps):
+            return laps.iloc[:n_warmup], laps.iloc[n_warmup:-n_cooldown], laps.iloc[-n_cooldown:]
+    # Manual laps
+    if manual and 'lap_trigger' in laps and laps['lap_trigger'].isin(MANUAL_LAP_TRIGGERS).all():
+        return laps.iloc[:1], laps.iloc[1:-1], laps.iloc[-1:]
+    return None, None, None
+
+def watch_stats(table: pd.DataFrame, time_field: str = 'total_elapsed_time') -> dict:
+    '''
+    Function that computes statistics from the totals of the watch (laps or session summary)
+    instead of the records
+
+    Inputs :
+    - table : lap or session table
+    - time_field : total used for the running time ('total_elapsed_time' with the pauses,
+    'total_timer_time' without them)
+
+    Output : dictionnary of statistics (same names as all_session_stat), only for the totals
+    known by the watch (a metric is left out when one of its fields is missing or empty)
+    '''
+    if table is None or len(table) == 0:
+        return {}
+
+    def known(*fields):
+        # Fields present and filled for every row of the table
+        return all(field in table and table[field].notna().all() for field in fields)
+
+    stats = {}
+    if known('total_distance'):
+        stats['Total_distance_km'] = round(float(table['total_distance'].sum())/1000, 2)
+    if known(time_field):
+        stats['Running_time'] = str(pd.Timedelta(seconds=round(float(table[time_field].sum())))).split( )[2]
+    if known('max_heart_rate'):
+        stats['Max_hr_bpm'] = int(table['max_heart_rate'].max())
+    # Averages weighted by the time in movement
+    if known('avg_heart_rate', 'total_timer_time') and table['total_timer_time'].sum() > 0:
+        stats['Average_hr_bpm'] = int((table['avg_heart_rate'] * table['total_timer_time']).sum() / table['total_timer_time'].sum())
+    if known('total_ascent'):
+        stats['Elevation_gain_m'] = round(float(table['total_ascent'].sum()),2)
+    if known('total_descent'):
+        stats['Elevation_loss_m'] = -round(float(table['total_descent'].sum()),2)
+    if known('total_distance', 'total_timer_time') and table['total_timer_time'].sum() > 0:
+        avg_speed = table['total_distance'].sum() / table['total_timer_time'].sum()
+        stats['Average_enhanced_speed_m/s'] = round(float(avg_speed),2)
+        stats['Average_enhanced_speed_km/h'] = round(float(avg_speed*3.6),2)
+        stats['Pace_min/km'] = round(1000 / (stats['Average_enhanced_speed_m/s'] * 60),2)
+    if known('enhanced_max_speed'):
+        stats['Max_enhanced_speed_m/s'] = round(float(table['enhanced_max_speed'].max()),2)
+        stats['Max_enhanced_speed_km/h'] = round(float(table['enhanced_max_speed'].max()*3.6),2)
+    return stats
+
+def all_session_stat(df : pd.DataFrame, session: pd.DataFrame = None):
     '''
     This function creates a dataframe with some statistics such as total distance, 
     running time, maximum, minimum and the average heart rate, maximum, minimum and the average altitude,
     the elevetion gain and loss, the average and maximum speed, the pace and the average temperature.
 
-    Input : df :Dataframe of datas
+    Input : 
+    - df :Dataframe of datas (resampled by resample_session for averages weighted by time)
+    - session : session summary of the watch, its totals are used when available
 
     Output : df_stats : a dataframe with statistics
     '''
     stats = {}
+    # Points outside the gaps, for the averages
+    valid = grid_valid(df)
     # Total distance (value of the last row)
     stats['Total_distance_km'] = round(float(df['distance'].iloc[-1])/1000, 2)
     # Running time (difference between the last and the first timestamp)
@@ -127,59 +382,81 @@ def all_session_stat(df : pd.DataFrame):
     # Maximum, minimum and average heart rate
     stats['Max_hr_bpm'] = int(df['heart_rate'].max())
     stats['Min_hr_bpm'] = int(df['heart_rate'].min())
-    stats['Average_hr_bpm'] = int(df['heart_rate'].mean())
+    stats['Average_hr_bpm'] = int(time_weighted_mean(df['heart_rate'], valid))
     # Maximum, minimum and average altitude
     stats['Max_altitude_m'] = int(df['altitude'].max())
     stats['Min_altitude_m'] = int(df['altitude'].min())
-    stats['Average_altitude_m'] = int(df['altitude'].mean())
+    stats['Average_altitude_m'] = int(time_weighted_mean(df['altitude'], valid))
     # Elevation gain and loss
     # Difference between two consecutive altitude values
     altitude_diff = df['altitude'].diff()
     stats['Elevation_gain_m'] = round(float(altitude_diff[altitude_diff > 0].sum()),2)
     stats['Elevation_loss_m'] = round(float(altitude_diff[altitude_diff < 0].sum()),2)
     # Average and maximum speed
-    stats['Average_enhanced_speed_m/s'] = round(float(df['enhanced_speed'].mean()),2)
-    stats['Average_enhanced_speed_km/h'] = round(float(df['enhanced_speed'].mean()*3.6),2)
+    stats['Average_enhanced_speed_m/s'] = round(time_weighted_mean(df['enhanced_speed'], valid),2)
+    stats['Average_enhanced_speed_km/h'] = round(time_weighted_mean(df['enhanced_speed'], valid)*3.6,2)
     stats['Max_enhanced_speed_m/s'] = round(float(df['enhanced_speed'].max()),2)
     stats['Max_enhanced_speed_km/h'] = round(float(df['enhanced_speed'].max()*3.6),2)
-    stats['Average_speed_m/s'] = round(float(df['speed'].mean()),2)
+    stats['Average_speed_m/s'] = round(time_weighted_mean(df['speed'], valid),2)
     # Pace (min/km)
     stats['Pace_min/km'] = round(1000 / (stats['Average_enhanced_speed_m/s'] * 60),2)
-    stats['Average_temperature'] = round(float(df['temperature'].mean()),2)
+    stats['Average_temperature'] = round(time_weighted_mean(df['temperature'], valid),2)
+    # Totals of the watch when available
+    stats.update(watch_stats(session))
     # Dico to dataframe
     df_stats = pd.DataFrame(stats.items(), columns=["Metric", "Value"])
     return df_stats
 
-def running_session_stats(df_warmup: pd.DataFrame, df_speed_interval: pd.DataFrame, df_cooldown: pd.DataFrame):
+def running_session_stats(df_warmup: pd.DataFrame, df_speed_interval: pd.DataFrame, df_cooldown: pd.DataFrame, laps: pd.DataFrame = None):
     '''
     Function that creates three dataframes with statistics of each session part
 
-    Input : Dataframe of datas
+    Input : 
+    - Dataframe of datas (resampled by resample_session for averages weighted by time)
+    - laps : lap table of the watch, the totals of the laps of each part are used when available
+    and when the laps start with the part (split_session may have used the timer pauses instead)
     Outputs : Three dataframes
     '''
     # Dico with all the intervals
     df_zone = {'Warmup' : df_warmup, 'Speed_interval' : df_speed_interval, 'Cooldown' : df_cooldown}
+    # Laps of each part, kept only if the bounds of the laps and of the parts are the same
+    laps_zone = dict(zip(df_zone, split_laps(laps)))
+    starts = [df['timestamp'].iloc[0] if len(df) else None for df in (df_speed_interval, df_cooldown)]
+    if laps_zone['Speed_interval'] is not None:
+        lap_starts = [laps_zone['Speed_interval']['start_time'].iloc[0], laps_zone['Cooldown']['start_time'].iloc[0]]
+        aligned = [start is not None and abs((start - lap_start).total_seconds()) <= LAP_ALIGNMENT
+                   for start, lap_start in zip(starts, lap_starts)]
+        # Warm-up : first bound, speed intervals : both bounds, cool-down : second bound
+        for name, ok in zip(df_zone, (aligned[0], aligned[0] and aligned[1], aligned[1])):
+            if not ok:
+                laps_zone[name] = None
     # Dico to stock results
     dico_interval={}
     # Loop on each dataframe
     for name, df in df_zone.items():
+        # Points outside the gaps, for the averages
+        valid = grid_valid(df)
         dico_interval[f'Total_distance_km_{name}'] = round(float(df['distance'].iloc[-1] - df['distance'].iloc[0])/1000, 2)
         dico_interval[f'Running_time_{name}'] = str(df['timestamp'].iloc[-1] - df['timestamp'].iloc[0]).split( )[2]
         dico_interval[f'Max_hr__bpm_{name}'] = int(df['heart_rate'].max())
         dico_interval[f'Min_hr_bpm_{name}'] = int(df['heart_rate'].min())
-        dico_interval[f'Average_hr_bpm_{name}'] = int(df['heart_rate'].mean())
+        dico_interval[f'Average_hr_bpm_{name}'] = int(time_weighted_mean(df['heart_rate'], valid))
         dico_interval[f'Max_altitude_m_{name}'] = int(df['altitude'].max())
         dico_interval[f'Min_altitude_m_{name}'] = int(df['altitude'].min())
-        dico_interval[f'Average_altitude_m_{name}'] = int(df['altitude'].mean())
+        dico_interval[f'Average_altitude_m_{name}'] = int(time_weighted_mean(df['altitude'], valid))
         altitude_diff = df['altitude'].diff()
         dico_interval[f'Elevation_gain_m_{name}'] = round(float(altitude_diff[altitude_diff > 0].sum()),2)
         dico_interval[f'Elevation_loss_m_{name}'] = round(float(altitude_diff[altitude_diff < 0].sum()),2)
-        dico_interval[f'Average_enhanced_speed_m/s_{name}'] = round(float(df['enhanced_speed'].mean()),2)
-        dico_interval[f'Average_enhanced_speed_km/h_{name}'] = round(float(df['enhanced_speed'].mean()*3.6),2)
+        dico_interval[f'Average_enhanced_speed_m/s_{name}'] = round(time_weighted_mean(df['enhanced_speed'], valid),2)
+        dico_interval[f'Average_enhanced_speed_km/h_{name}'] = round(time_weighted_mean(df['enhanced_speed'], valid)*3.6,2)
         dico_interval[f'Max_enhanced_speed_m/s_{name}'] = round(float(df['enhanced_speed'].max()),2)
         dico_interval[f'Max_enhanced_speed_km/h_{name}'] = round(float(df['enhanced_speed'].max()*3.6),2)
-        dico_interval[f'Average_speed_m/s_{name}'] = round(float(df['speed'].mean()),2)
+        dico_interval[f'Average_speed_m/s_{name}'] = round(time_weighted_mean(df['speed'], valid),2)
         dico_interval[f'Pace_min/km_{name}'] = round(1000 / (dico_interval[f'Average_enhanced_speed_m/s_{name}'] * 60),2)
+        # Totals of the watch when available (same metric names as above)
+        for key, value in watch_stats(laps_zone[name], 'total_timer_time').items():
+            key = 'Max_hr__bpm' if key == 'Max_hr_bpm' else key
+            dico_interval[f'{key}_{name}'] = value
 
     dico_warmup = {}
     dico_speed = {}
@@ -200,6 +477,71 @@ def running_session_stats(df_warmup: pd.DataFrame, df_speed_interval: pd.DataFra
     df_cooldown_stat = pd.DataFrame(dico_cooldown.items(), columns=["Metric", "Value"])
     return df_warmup_stat, df_speed_stat, df_cooldown_stat
 
+def hr_recovery(df: pd.DataFrame, rest_start, rest_end, taus=np.geomspace(5, 300, 80)):
+    '''
+    Function that models the heart rate recovery of every rest period at once
+
+    Inputs :
+    - df : Dataframe of datas (with 'time' in minutes and 'heart_rate')
+    - rest_start, rest_end : arrays with the start and end (min) of each rest
+    - taus : candidate time constants (s) for the exponential decay
+
+    Output : a dataframe with, for each rest, the heart rate drop after 30 s and 60 s
+    and the time constant tau (s) of the fit HR(t) = a + b * exp(-t / tau)
+    '''
+    # Time in seconds and heart rate as numpy arrays (without the missing values, e.g. gaps of a resampled session)
+    t = df['time'].to_numpy(dtype=float) * 60
+    hr = df['heart_rate'].to_numpy(dtype=float)
+    valid = ~np.isnan(t) & ~np.isnan(hr)
+    t, hr = t[valid], hr[valid]
+    start = np.asarray(rest_start, dtype=float) * 60
+    end = np.asarray(rest_end, dtype=float) * 60
+    # No heart rate (e.g. watch without sensor) : no recovery
+    if len(t) == 0:
+        nan = np.full(len(start), np.nan)
+        return pd.DataFrame({'HR_drop_30s (bpm)': nan, 'HR_drop_60s (bpm)': nan, 'HR_recovery_tau (s)': nan})
+
+    # Heart rate at the start of the rest, 30 s and 60 s later (NaN if the rest is shorter)
+    hr_start = np.interp(start, t, hr)
+    drop_30 = np.where(end - start >= 30, hr_start - np.interp(start + 30, t, hr), np.nan)
+    drop_60 = np.where(end - start >= 60, hr_start - np.interp(start + 60, t, hr), np.nan)
+
+    # Padded matrix (rest x sample) of the rows belonging to each rest
+    first = np.searchsorted(t, start, side='left')
+    last = np.searchsorted(t, end, side='right')
+    width = int(max((last - first).max(initial=0), 1))
+    idx = first[:, None] + np.arange(width)
+    mask = idx < last[:, None]
+    idx = np.minimum(idx, len(t) - 1)
+    t_rel = np.where(mask, t[idx] - start[:, None], 0.0)
+    y = np.where(mask, hr[idx], 0.0)
+
+    # For each candidate tau the model is linear in (a, b) : closed form least squares
+    # for all rests and all taus in one pass (rest x sample x tau)
+    e = np.exp(-t_rel[:, :, None] / np.asarray(taus)[None, None, :]) * mask[:, :, None]
+    n = mask.sum(axis=1)[:, None].astype(float)
+    sx = e.sum(axis=1)
+    sxx = (e * e).sum(axis=1)
+    sy = y.sum(axis=1)[:, None]
+    syy = (y * y).sum(axis=1)[:, None]
+    sxy = (e * y[:, :, None]).sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        b = (n * sxy - sx * sy) / (n * sxx - sx * sx)
+        a = (sy - b * sx) / n
+        sse = syy - a * sy - b * sxy
+    # Only a decay (b > 0) is a recovery
+    sse = np.where(np.isfinite(sse) & (b > 0), sse, np.inf)
+    best = sse.argmin(axis=1)
+    # A tau on the edge of the grid is not a real minimum
+    valid = np.isfinite(sse.min(axis=1, initial=np.inf)) & (n[:, 0] >= 3) & (best > 0) & (best < len(taus) - 1)
+    tau = np.where(valid, np.asarray(taus)[best], np.nan)
+
+    return pd.DataFrame({
+        'HR_drop_30s (bpm)': np.round(drop_30, 2),
+        'HR_drop_60s (bpm)': np.round(drop_60, 2),
+        'HR_recovery_tau (s)': np.round(tau, 1)
+    })
+
 def speed_session_stat(df_speed_interval: pd.DataFrame, threshold : float):
     '''
     Function that creates a dataframe with statistics of the speed interval session part
@@ -209,66 +551,34 @@ def speed_session_stat(df_speed_interval: pd.DataFrame, threshold : float):
     - df_intervals_speed : statistics of the speed intervals
     - df_intervals_rest : statistics of the rest intervals
     '''
-    # Keep only relevant datas ie enhanced_speed > threshold
-    df_speed_interval['is_effort'] = df_speed_interval['enhanced_speed']> threshold
-    # New column to identify blocks
-    df_speed_interval['change'] = df_speed_interval['is_effort'].ne(df_speed_interval['is_effort'].shift())
-    # Cumulative sum to identify blocks
-    df_speed_interval['block'] = df_speed_interval['change'].cumsum()
-    intervals_speed = []
+    # Effort and rest runs (the same runs as in the interval index)
+    runs = interval_runs(df_speed_interval, threshold)
+    efforts = runs[runs['effort']]
+    rests = runs[~runs['effort']]
 
     # effort block analysis
-    for _, group in df_speed_interval.groupby('block'):
-        # effort block
-        if group['is_effort'].iloc[0]: 
-            # first row and last row of the block
-            start_time = group['time'].iloc[0]
-            end_time = group['time'].iloc[-1]
-            duration = end_time - start_time
-            # Statistics
-            avg_speed = group['enhanced_speed'].mean()
-            max_speed = group['enhanced_speed'].max()
-            avg_hr = group['heart_rate'].mean()
-            max_hr = group['heart_rate'].max()
-            avg_pace = 1000 / (group['enhanced_speed']*60).mean()
-            # Append to the list
-            intervals_speed.append({
-                'Start_time (min)': start_time,
-                'End_time (min)': end_time,
-                'Duration (min)': duration,
-                'Average_speed (m/s)': round(avg_speed,2),
-                'Max_speed (m/s)': round(max_speed,2),
-                'Average_HR (bpm)': round(avg_hr,2),
-                'Max_HR (bpm)': max_hr,
-                'Average_pace (min/km)': round(avg_pace,2)
-            })
-    # Dico to dataframe
-    df_intervals_speed = pd.DataFrame(intervals_speed)
-
-    # rest block analysis
-    rests=[]
-    # Loop on the length of the dataframe
-    for i in range(len(df_intervals_speed)-1):
-        # Rest start and end + duration
-        rest_start = df_intervals_speed['End_time (min)'].iloc[i]
-        rest_end = df_intervals_speed['Start_time (min)'].iloc[i+1]
-        rest_duration = rest_end - rest_start
-        
-        # Average speed of rest 
-        avg_speed = df_speed_interval[(df_speed_interval['time'] >= rest_start) & (df_speed_interval['time'] <= rest_end)]['enhanced_speed'].mean()
-        # Average heart rate of rest
-        avg_hr = df_speed_interval[(df_speed_interval['time'] >= rest_start) & (df_speed_interval['time'] <= rest_end)]['heart_rate'].mean()
-        # Average pace of rest
-        avg_pace = (1000 / df_speed_interval[(df_speed_interval['time'] >= rest_start) & (df_speed_interval['time'] <= rest_end)]['enhanced_speed'] * 60).mean()
-        # Append to the list
-        rests.append({
-            'Rest_start (min)': rest_start,
-            'Rest_end (min)': rest_end,
-            'Rest_duration (min)': rest_duration,
-            'Average_rest_HR (bpm)': round(avg_hr,2)
-        })
-    # Dico to dataframe
-    df_intervals_rest = pd.DataFrame(rests)
+    df_intervals_speed = pd.DataFrame({
+        'Start_time (min)': efforts['start_time'],
+        'End_time (min)': efforts['end_time'],
+        'Duration (min)': efforts['end_time'] - efforts['start_time'],
+        'Average_speed (m/s)': efforts['mean_speed'].round(2),
+        'Max_speed (m/s)': efforts['max_speed'].round(2),
+        'Average_HR (bpm)': efforts['mean_hr'].round(2),
+        'Max_HR (bpm)': efforts['max_hr'].astype('Int64'),
+        'Average_pace (min/km)': (1000 / (efforts['mean_speed']*60)).round(2)
+    }).reset_index(drop=True)
+
+    # rest block analysis (from the end of an effort to the start of the next one)
+    df_intervals_rest = pd.DataFrame({
+        'Rest_start (min)': rests['start_time'],
+        'Rest_end (min)': rests['end_time'],
+        'Rest_duration (min)': rests['end_time'] - rests['start_time'],
+        'Average_rest_HR (bpm)': rests['mean_hr'].round(2)
+    }).reset_index(drop=True)
+    # Heart rate recovery of all the rests at once
+    if len(df_intervals_rest) > 0:
+        df_recovery = hr_recovery(df_speed_interval, df_intervals_rest['Rest_start (min)'], df_intervals_rest['Rest_end (min)'])
+        df_intervals_rest = pd.concat([df_intervals_rest, df_recovery], axis=1)
 
     # Minute formating
     df_intervals_speed['Start_time (min)'] = df_intervals_speed['Start_time (min)'].apply(format_minutes)
@@ -280,6 +590,160 @@ def speed_session_stat(df_speed_interval: pd.DataFrame, threshold : float):
     df_intervals_rest['Rest_duration (min)'] = df_intervals_rest['Rest_duration (min)'].apply(format_minutes)
     return df_intervals_speed, df_intervals_rest
 
+def interval_runs(df_speed_interval: pd.DataFrame, threshold: float) -> pd.DataFrame:
+    '''
+    Function that describes every effort and rest run of the speed interval part with numeric values
+    (used by speed_session_stat and the interval index)
+
+    Input : Dataframe of datas (resampled by resample_session for means weighted by time)
+    and a threshold to define the speed intervals
+    Output : a dataframe with one row per run : effort (bool), start and end (timestamps),
+    duration (s), mean and max speed, mean and max heart rate, mean cadence and step length,
+    start_time and end_time (min, 'time' column of the session)
+    '''
+    df = df_speed_interval.reindex(columns=['timestamp', 'time', 'enhanced_speed', 'heart_rate', 'cadence', 'step_length'])
+    valid = grid_valid(df_speed_interval)
+    # Blocks of consecutive rows with the same effort state : first and last row of each block
+    is_effort = (df['enhanced_speed'] > threshold).to_numpy()
+    first = np.flatnonzero(np.concatenate([[True], is_effort[1:] != is_effort[:-1]])) if len(df) else np.array([], dtype=int)
+    last = np.concatenate([first[1:], [len(df)]]) - 1
+    effort = is_effort[first]
+    # Rests are the blocks between two efforts
+    efforts = np.flatnonzero(effort)
+    keep = slice(efforts[0], efforts[-1] + 1) if len(efforts) else slice(0)
+    first, last, effort = first[keep], last[keep], effort[keep]
+
+    runs = {'effort': effort}
+    timestamp = df['timestamp'].to_numpy()
+    time = df['time'].to_numpy(dtype=float)
+    # A rest goes from the end of the previous effort to the start of the next one
+    for name, values in (('start', timestamp), ('start_time', time)):
+        runs[name] = values[first]
+        runs[name][~effort] = values[last[np.flatnonzero(~effort) - 1]]
+    for name, values in (('end', timestamp), ('end_time', time)):
+        runs[name] = values[last]
+        runs[name][~effort] = values[first[np.flatnonzero(~effort) + 1]]
+    # Means of the blocks from the cumulative integrals (points outside the gaps), maxima by block
+    for column, mean, maximum in (('enhanced_speed', 'mean_speed', 'max_speed'), ('heart_rate', 'mean_hr', 'max_hr'),
+                                  ('cadence', 'cadence', None), ('step_length', 'step_length', None)):
+        values = df[column].to_numpy(dtype=float)
+        total = np.concatenate([[0], cumulative_integral(values, valid)])
+        count = np.concatenate([[0], cumulative_integral(np.ones(len(values)), valid & ~np.isnan(values))])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            runs[mean] = (total[last + 1] - total[first]) / (count[last + 1] - count[first])
+        if maximum is not None:
+            runs[maximum] = np.fmax.reduceat(np.where(valid, values, np.nan), first) if len(first) else np.empty(0)
+    # Heart rate in bpm, as recorded by the watch (not the interpolated values of the grid)
+    runs['max_hr'] = np.round(runs['max_hr'])
+
+    runs = pd.DataFrame(runs, columns=['effort', 'start', 'end', 'mean_speed', 'max_speed', 'mean_hr', 'max_hr',
+                                       'cadence', 'step_length', 'start_time', 'end_time'])
+    runs.insert(3, 'duration', (runs['end'] - runs['start']).dt.total_seconds())
+    return runs
+
+def threshold_sweep(df_speed_interval: pd.DataFrame, thresholds, effort: float = None, rest: float = None):
+    '''
+    Function that evaluates many speed thresholds at once to detect the speed intervals
+    and chooses the one matching the structure of the workout
+
+    Inputs :
+    - df_speed_interval : Dataframe of datas (with 'enhanced_speed' and 'time' in minutes)
+    - thresholds : candidate speed thresholds (m/s)
+    - effort, rest : expected durations (s) of the efforts and rests (e.g. 30 and 50),
+    if None the threshold with the most regular efforts is chosen
+
+    Outputs :
+    - df_sweep : for each threshold, the number of efforts, their durations, the mean rest duration,
+    a regularity score (1 - coefficient of variation of the effort durations) and the error with the workout
+    - best_threshold : the chosen threshold, None if no threshold gives at least two efforts
+    '''
+    speed = df_speed_interval['enhanced_speed'].to_numpy(dtype=float)
+    t = df_speed_interval['time'].to_numpy(dtype=float) * 60
+    thresholds = np.asarray(thresholds, dtype=float)
+    k = len(thresholds)
+
+    # Effort mask for every threshold (threshold x row), padded with rest on both sides
+    is_effort = np.pad(speed[None, :] > thresholds[:, None], ((0, 0), (1, 1)))
+    change = np.diff(is_effort.astype(np.int8), axis=1)
+    # Start (first row) and end (last row + 1) of every effort block, ordered by threshold then time
+    start_row, start_col = np.nonzero(change == 1)
+    _, end_col = np.nonzero(change == -1)
+    durations = t[end_col - 1] - t[start_col]
+
+    # Rests between two consecutive efforts of the same threshold
+    same = start_row[1:] == start_row[:-1]
+    rest_row = start_row[1:][same]
+    rests = (t[start_col[1:]] - t[end_col[:-1] - 1])[same]
+
+    # Aggregation per threshold
+    reps = np.bincount(start_row, minlength=k)
+    n_rests = np.bincount(rest_row, minlength=k)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_duration = np.bincount(start_row, weights=durations, minlength=k) / reps
+        std_duration = np.sqrt(np.maximum(np.bincount(start_row, weights=durations**2, minlength=k) / reps - mean_duration**2, 0))
+        mean_rest = np.bincount(rest_row, weights=rests, minlength=k) / n_rests
+        regularity = np.where(reps >= 2, np.clip(1 - std_duration / mean_duration, 0, 1), np.nan)
+        # Mean relative error with the expected effort and rest durations
+        error = np.zeros(k)
+        if effort is not None:
+            error += np.bincount(start_row, weights=np.abs(durations - effort), minlength=k) / reps / effort
+        if rest is not None:
+            error += np.bincount(rest_row, weights=np.abs(rests - rest), minlength=k) / n_rests / rest
+    error = np.where(reps >= 2, error, np.inf)
+
+    # Best threshold : smallest error with the workout, or most regular efforts
+    if effort is None and rest is None:
+        best = int(np.nanargmax(np.where(reps >= 2, regularity, -1)))
+    else:
+        best = int(np.argmin(error))
+
+    df_sweep = pd.DataFrame({
+        'Threshold (m/s)': np.round(thresholds, 2),
+        'Reps': reps,
+        'Rep_durations (s)': np.split(durations, np.cumsum(reps)[:-1]),
+        'Mean_rep_duration (s)': np.round(mean_duration, 1),
+        'Std_rep_duration (s)': np.round(std_duration, 1),
+        'Mean_rest_duration (s)': np.round(mean_rest, 1),
+        'Regularity': np.round(regularity, 3),
+        'Workout_error': np.round(error, 3)
+    })
+    # No threshold gives at least two efforts
+    if reps[best] < 2:
+        return df_sweep, None
+    return df_sweep, round(float(thresholds[best]), 2)
+
+def session_load(df: pd.DataFrame, max_hr: float = None, threshold_speed: float = None, gap: float = WATCH_OFF_GAP) -> float:
+    '''
+    Function that computes the training load of a session
+
+    Inputs :
+    - df : Dataframe of datas
+    - max_hr : maximum heart rate of the athlete, the same for all the sessions so that their loads
+    can be compared (needed when the session has heart rate)
+    - threshold_speed : threshold speed (m/s), used for the pace based load when there is no heart rate
+    - gap : time between two rows (s) above which the watch is considered off
+
+    Output : the TRIMP of the session (minutes in each heart rate zone weighted by the zone number)
+    or, without heart rate, a pace based load (hours * (average speed / threshold speed)^2 * 100)
+    '''
+    # Time (s) of each row, without the breaks when the watch is off
+    dt = df['timestamp'].diff().dt.total_seconds().to_numpy()
+    dt = np.where(dt <= gap, dt, 0)
+    if 'heart_rate' in df and df['heart_rate'].notna().any():
+        if max_hr is None:
+            raise ValueError("max_hr of the athlete is needed to compute the load of a session with heart rate")
+        hr = df['heart_rate'].to_numpy(dtype=float)
+        # Zone number (1 to 5) with the same bounds as get_hr_zone
+        zone = np.searchsorted(np.array([0.6, 0.7, 0.8, 0.9])*max_hr, hr, side='right') + 1
+        return round(float(np.sum(np.where(np.isnan(hr), 0, dt*zone)) / 60), 1)
+    if threshold_speed is None:
+        raise ValueError("threshold_speed is needed to compute the load of a session without heart rate")
+    # Moving time and average speed
+    speed = df['enhanced_speed'].to_numpy(dtype=float)
+    moving = np.where(speed > 0, dt, 0)
+    avg_speed = np.nansum(speed*moving) / moving.sum()
+    return round(float(moving.sum() / 3600 * (avg_speed / threshold_speed)**2 * 100), 1)
+
 def pace(df:pd.DataFrame):
     '''
     Function that creates a dataframe with pace bins and the time spent in each bin
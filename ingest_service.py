@@ -0,0 +1,332 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import signal
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import parse_qs
+import numpy as np
+import pandas as pd
+import functions as fc
+from interval_index import IntervalIndex
+from training_load import TrainingLoad
+
+logger = logging.getLogger("ingest_service")
+
+# Maximum size of an uploaded file (bytes)
+MAX_UPLOAD = 64 * 1024 * 1024
+# Minimum number of efforts and regularity of a session without workout laps to index its runs
+MIN_REPS = 4
+MIN_REGULARITY = 0.7
+
+def process_file(path: str, max_hr: float = None, threshold_speed: float = None) -> dict:
+    '''
+    Function (run in a worker process) that decodes a FIT file and precomputes the standard statistics
+
+    Inputs :
+    - path of the FIT file
+    - max_hr : maximum heart rate of the athlete (load of the sessions with heart rate)
+    - threshold_speed : threshold speed of the athlete (m/s, load of the sessions without heart rate)
+
+    Output : dictionnary with the session id (hash of the file), its date, its load (None if it can't be computed),
+    the statistics dataframes and, for interval workouts, the runs of the speed intervals
+    '''
+    with open(path, 'rb') as f:
+        session_id = hashlib.sha1(f.read()).hexdigest()[:16]
+    df_data, df_unit, tables = fc.import_data_fit(path, side_tables=True)
+    # Same preparation as the app
+    df_data = df_data.sort_values('timestamp').reset_index(drop=True)
+    df_data['delta_time'] = df_data['timestamp'].diff().dt.total_seconds()
+    df_data['time'] = (df_data['timestamp'] - df_data['timestamp'].iloc[0]).dt.total_seconds()/60
+
+    results = {
+        'session_id': session_id,
+        'file': os.path.basename(path),
+        'date': df_data['timestamp'].iloc[0],
+        'load': None,
+        # Session on the uniform 1 s grid, as in the app
+        'stats': fc.all_session_stat(fc.resample_session(df_data, step=1.0), tables['session'])
+    }
+    try:
+        results['load'] = fc.session_load(df_data, max_hr=max_hr, threshold_speed=threshold_speed)
+    except ValueError as e:
+        logger.warning("No load for %s : %s", path, e)
+    # Interval statistics, only for sessions with a warm-up, speed intervals and a cool-down
+    try:
+        df_warmup, df_speed_interval, df_cooldown = fc.split_session(df_data, tables['lap'], tables['event'])
+        df_warmup, df_speed_interval, df_cooldown = (fc.resample_session(df, step=1.0) for df in (df_warmup, df_speed_interval, df_cooldown))
+        results['part_stats'] = fc.running_session_stats(df_warmup, df_speed_interval, df_cooldown, tables['lap'])
+        df_sweep, threshold = fc.threshold_sweep(df_speed_interval, np.arange(3.0, 6.0, 0.1))
+        if threshold is None:
+            raise ValueError("no speed intervals")
+        results['threshold'] = threshold
+        results['intervals'] = fc.speed_session_stat(df_speed_interval, threshold)
+        # Runs indexed only for interval workouts : workout (or manual) laps, or many regular efforts
+        best = df_sweep.loc[df_sweep['Threshold (m/s)'] == threshold].iloc[0]
+        workout_laps = fc.split_laps(tables['lap'])[1] is not None
+        if workout_laps or (best['Reps'] >= MIN_REPS and best['Regularity'] >= MIN_REGULARITY):
+            results['runs'] = fc.interval_runs(df_speed_interval, threshold)
+    except (ValueError, KeyError, IndexError) as e:
+        logger.info("No interval statistics for %s : %s", path, e)
+    return results
+
+class IngestService:
+    '''
+    Local ingestion service : FIT files dropped in a folder (or uploaded over HTTP) are queued,
+    decoded on a process pool and their statistics are published to the cache and the catalog
+
+    The queue is bounded : when it is full, the folder watcher and the uploads wait (backpressure).
+    The interval index and the training load are written by this process only, and saved
+    at most every flush seconds.
+    '''
+
+    def __init__(self, drop: str, catalog: str, max_hr: float = None, threshold_speed: float = None,
+                 workers: int = None, queue_size: int = 32, poll: float = 2.0, flush: float = 5.0):
+        '''
+        Inputs :
+        - drop : folder where the watches sync the FIT files
+        - catalog : directory of the catalog (cache, interval index and training load)
+        - max_hr : maximum heart rate of the athlete (load of the sessions with heart rate)
+        - threshold_speed : threshold speed of the athlete (m/s, load of the sessions without heart rate)
+        - workers : number of worker processes (None for the number of CPUs)
+        - queue_size : maximum number of files waiting to be decoded
+        - poll : time (s) between two scans of the drop folder
+        - flush : time (s) between two saves of the catalog
+        '''
+        self.drop = drop
+        self.catalog = catalog
+        self.cache = os.path.join(catalog, 'cache')
+        for folder in (drop, self.cache, os.path.join(drop, 'processed'), os.path.join(drop, 'failed')):
+            os.makedirs(folder, exist_ok=True)
+        self.max_hr = max_hr
+        self.threshold_speed = threshold_speed
+        self.workers = workers or os.cpu_count()
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.poll = poll
+        self.flush = flush
+        self.intervals = IntervalIndex(catalog)
+        self.training_load = TrainingLoad(catalog)
+        self._dirty = False
+        # Files queued or in progress, and sizes seen at the previous scan
+        self._pending = set()
+        self._sizes = {}
+        # Metrics
+        self.in_progress = 0
+        self.processed = 0
+        self.failed = 0
+        self._started = time.monotonic()
+        self._done = deque(maxlen=1000)      # end time of the last files
+        self._latencies = deque(maxlen=1000) # time between queued and published
+
+    async def enqueue(self, path: str):
+        '''
+        Function that queues a file (waits while the queue is full)
+        '''
+        self._pending.add(path)
+        await self.queue.put((path, time.monotonic()))
+
+    async def watch(self):
+        '''
+        Task that scans the drop folder and queues the new FIT files once their size is stable
+        '''
+        while True:
+            sizes = {}
+            for entry in os.scandir(self.drop):
+                if entry.is_file() and entry.name.lower().endswith('.fit') and entry.path not in self._pending:
+                    sizes[entry.path] = entry.stat().st_size
+            for path, size in sizes.items():
+                # Same size as at the previous scan : the sync of the file is finished
+                if self._sizes.get(path) == size:
+                    await self.enqueue(path)
+            self._sizes = {path: size for path, size in sizes.items() if path not in self._pending}
+            await asyncio.sleep(self.poll)
+
+    async def worker(self, pool: ProcessPoolExecutor):
+        '''
+        Task that decodes the queued files on the process pool and publishes the results
+        '''
+        loop = asyncio.get_running_loop()
+        while True:
+            path, queued = await self.queue.get()
+            self.in_progress += 1
+            try:
+                folder = 'processed'
+                try:
+                    results = await loop.run_in_executor(pool, process_file, path, self.max_hr, self.threshold_speed)
+                    self.publish(results)
+                    self.processed += 1
+                    self._latencies.append(time.monotonic() - queued)
+                except Exception:
+                    logger.exception("Ingestion of %s failed", path)
+                    folder = 'failed'
+                    self.failed += 1
+                try:
+                    self._archive(path, folder)
+                    self._pending.discard(path)
+                except OSError:
+                    # The file is still in the drop folder : it stays pending so that it is not queued again
+                    logger.exception("Archiving of %s failed", path)
+            finally:
+                self._done.append(time.monotonic())
+                self.in_progress -= 1
+                self.queue.task_done()
+
+    def _archive(self, path: str, folder: str):
+        # Move the file out of the drop folder so that it is not queued again,
+        # without overwriting an archived file with the same name
+        if os.path.exists(path):
+            name, ext = os.path.splitext(os.path.basename(path))
+            target = os.path.join(self.drop, folder, name + ext)
+            n = 1
+            while os.path.exists(target):
+                target = os.path.join(self.drop, folder, f"{name}_{n}{ext}")
+                n += 1
+            shutil.move(path, target)
+
+    def publish(self, results: dict):
+        '''
+        Function that publishes the results of a file to the cache and the catalog
+        '''
+        session_id = results['session_id']
+        pd.to_pickle(results, os.path.join(self.cache, f"{session_id}.pkl"))
+        if 'runs' in results:
+            self.intervals.add_session(session_id, results['runs'])
+        if results['load'] is not None:
+            self.training_load.add_session(session_id, results['date'], results['load'])
+        self._dirty = True
+        logger.info("Published %s (%s)", results['file'], session_id)
+
+    def save(self):
+        '''
+        Function that saves the catalog if it changed
+        '''
+        if self._dirty:
+            self.intervals.save()
+            self.training_load.save()
+            self._dirty = False
+
+    async def flusher(self):
+        '''
+        Task that saves the catalog regularly
+        '''
+        while True:
+            await asyncio.sleep(self.flush)
+            self.save()
+
+    def metrics(self) -> dict:
+        '''
+        Function that returns the metrics of the service : queue depth, throughput and latency
+        '''
+        now = time.monotonic()
+        latencies = np.array(self._latencies)
+        return {
+            'queue_depth': self.queue.qsize(),
+            'in_progress': self.in_progress,
+            'processed': self.processed,
+            'failed': self.failed,
+            'uptime_s': round(now - self._started, 1),
+            # Files per second over the last minute
+            'throughput_per_s': round(sum(1 for t in self._done if now - t <= 60) / min(60, max(now - self._started, 1e-9)), 3),
+            'latency_mean_s': round(float(latencies.mean()), 3) if len(latencies) else None,
+            'latency_p95_s': round(float(np.percentile(latencies, 95)), 3) if len(latencies) else None
+        }
+
+    async def handle_http(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        '''
+        Minimal HTTP endpoint :
+        - GET /metrics : metrics of the service
+        - POST /upload?name=file.fit : body = content of the FIT file
+        '''
+        try:
+            method, target, _ = (await reader.readline()).decode('latin-1').split()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                key, _, value = line.decode('latin-1').partition(':')
+                headers[key.strip().lower()] = value.strip()
+            route, _, query = target.partition('?')
+
+            if method == 'GET' and route == '/metrics':
+                status, body = 200, self.metrics()
+            elif method == 'POST' and route == '/upload':
+                length = int(headers.get('content-length', 0))
+                name = os.path.basename(parse_qs(query).get('name', [''])[0])
+                if length > MAX_UPLOAD:
+                    status, body = 413, {'error': 'file too large'}
+                elif not name.lower().endswith('.fit'):
+                    status, body = 400, {'error': 'name=<file>.fit is required'}
+                elif os.path.join(self.drop, name) in self._pending or os.path.exists(os.path.join(self.drop, name)):
+                    # A file with the same name is waiting in the drop folder : it would be overwritten
+                    status, body = 409, {'error': f'{name} is already queued'}
+                else:
+                    data = await reader.readexactly(length)
+                    path = os.path.join(self.drop, name)
+                    # Written under another name, so that the watcher does not see a partial file
+                    with open(path + '.part', 'wb') as f:
+                        f.write(data)
+                    self._pending.add(path)
+                    os.replace(path + '.part', path)
+                    await self.enqueue(path)
+                    status, body = 202, {'queued': name, 'queue_depth': self.queue.qsize()}
+            else:
+                status, body = 404, {'error': 'not found'}
+        except (ValueError, asyncio.IncompleteReadError) as e:
+            status, body = 400, {'error': str(e)}
+        except OSError as e:
+            logger.exception("Upload failed")
+            status, body = 500, {'error': str(e)}
+
+        payload = json.dumps(body).encode()
+        reasons = {200: 'OK', 202: 'Accepted', 400: 'Bad Request', 404: 'Not Found', 409: 'Conflict',
+                   413: 'Payload Too Large', 500: 'Internal Server Error'}
+        writer.write(f"HTTP/1.1 {status} {reasons[status]}\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode() + payload)
+        await writer.drain()
+        writer.close()
+
+    async def run(self, host: str = '127.0.0.1', port: int = 8765):
+        '''
+        Function that runs the service until SIGINT or SIGTERM
+        '''
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        # Workers started by a fork server : forked from the event loop, they would inherit
+        # the open upload connections and keep them open after the response
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('forkserver')) as pool:
+            server = await asyncio.start_server(self.handle_http, host, port)
+            tasks = [asyncio.create_task(self.watch()), asyncio.create_task(self.flusher())]
+            tasks += [asyncio.create_task(self.worker(pool)) for _ in range(self.workers)]
+            logger.info("Watching %s, listening on http://%s:%d", self.drop, host, port)
+            await stop.wait()
+            server.close()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        self.save()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local ingestion service of FIT files")
+    parser.add_argument('--drop', required=True, help="folder where the watches sync the FIT files")
+    parser.add_argument('--catalog', required=True, help="directory of the catalog")
+    parser.add_argument('--max-hr', type=float, default=None, help="maximum heart rate of the athlete (bpm)")
+    parser.add_argument('--threshold-speed', type=float, default=None,
+                        help="threshold speed of the athlete (m/s), for the load of sessions without heart rate")
+    parser.add_argument('--workers', type=int, default=None, help="number of worker processes")
+    parser.add_argument('--queue', type=int, default=32, help="maximum number of queued files")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    service = IngestService(args.drop, args.catalog, max_hr=args.max_hr, threshold_speed=args.threshold_speed,
+                            workers=args.workers, queue_size=args.queue)
+    asyncio.run(service.run(args.host, args.port))
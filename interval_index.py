@@ -0,0 +1,185 @@
+import os
+import numpy as np
+import pandas as pd
+
+# Numeric columns of the index and their storage type
+COLUMNS = {
+    'start': 'int64',        # epoch seconds
+    'end': 'int64',          # epoch seconds
+    'duration': 'float32',   # s
+    'mean_speed': 'float32', # m/s
+    'max_speed': 'float32',  # m/s
+    'mean_hr': 'float32',    # bpm
+    'max_hr': 'float32',     # bpm
+    'cadence': 'float32',    # rpm
+    'step_length': 'float32' # mm
+}
+
+class IntervalIndex:
+    '''
+    Columnar index of the effort and rest runs of all the sessions of a catalog
+
+    Each run is stored with its session, its kind (effort or rest) and the numeric columns
+    of COLUMNS in contiguous numpy arrays, so that filters and aggregations over hundreds
+    of thousands of runs are vectorized and do not need the FIT files.
+    The index is saved in the catalog directory as 'intervals.npz'.
+    '''
+
+    def __init__(self, catalog: str = None):
+        '''
+        Input : catalog : directory of the catalog (None for an index in memory only),
+        the existing index of the catalog is loaded
+        '''
+        self.path = os.path.join(catalog, 'intervals.npz') if catalog else None
+        # Session ids, the runs refer to them by their position
+        self.sessions = []
+        self._codes = {}
+        self._data = self._empty()
+        # Runs added since the last consolidation (concatenated lazily)
+        self._chunks = []
+        if self.path and os.path.exists(self.path):
+            self.load()
+
+    @staticmethod
+    def _empty() -> dict:
+        data = {'session': np.empty(0, dtype='int32'), 'effort': np.empty(0, dtype=bool)}
+        data.update({name: np.empty(0, dtype=dtype) for name, dtype in COLUMNS.items()})
+        return data
+
+    def __len__(self):
+        self._consolidate()
+        return len(self._data['session'])
+
+    def _consolidate(self):
+        # Concatenate the pending runs with the index
+        if self._chunks:
+            self._data = {name: np.concatenate([self._data[name]] + [chunk[name] for chunk in self._chunks])
+                          for name in self._data}
+            self._chunks = []
+
+    def add_session(self, session_id: str, runs: pd.DataFrame):
+        '''
+        Function that adds (or replaces) the runs of a session
+
+        Inputs :
+        - session_id : identifier of the session
+        - runs : dataframe of the runs (as returned by functions.interval_runs)
+        '''
+        session_id = str(session_id)
+        if session_id in self._codes:
+            self.remove_session(session_id)
+        else:
+            self._codes[session_id] = len(self.sessions)
+            self.sessions.append(session_id)
+        chunk = {
+            'session': np.full(len(runs), self._codes[session_id], dtype='int32'),
+            'effort': runs['effort'].to_numpy(dtype=bool)
+        }
+        for name, dtype in COLUMNS.items():
+            values = runs[name]
+            # Timestamps to epoch seconds
+            if name in ('start', 'end'):
+                values = pd.to_datetime(values).astype('datetime64[s]').astype('int64')
+            chunk[name] = np.asarray(values, dtype=dtype)
+        self._chunks.append(chunk)
+
+    def remove_session(self, session_id: str):
+        '''
+        Function that removes the runs of a session (its id is kept)
+        '''
+        self._consolidate()
+        code = self._codes.get(str(session_id))
+        if code is not None:
+            keep = self._data['session'] != code
+            self._data = {name: values[keep] for name, values in self._data.items()}
+
+    def _mask(self, effort=True, since=None, until=None, sessions=None, **ranges) -> np.ndarray:
+        '''
+        Function that creates the mask of the runs matching the filters
+        '''
+        self._consolidate()
+        data = self._data
+        mask = np.ones(len(data['session']), dtype=bool)
+        if effort is not None:
+            mask &= data['effort'] == effort
+        # Time window on the start of the run
+        if since is not None:
+            mask &= data['start'] >= pd.Timestamp(since).timestamp()
+        if until is not None:
+            mask &= data['start'] <= pd.Timestamp(until).timestamp()
+        if sessions is not None:
+            codes = [self._codes[s] for s in map(str, sessions) if s in self._codes]
+            mask &= np.isin(data['session'], codes)
+        # Ranges (min, max) on the numeric columns, None for no bound
+        for name, (low, high) in ranges.items():
+            if name not in COLUMNS:
+                raise KeyError(f"Unknown column {name}")
+            if low is not None:
+                mask &= data[name] >= low
+            if high is not None:
+                mask &= data[name] <= high
+        return mask
+
+    def query(self, effort=True, since=None, until=None, sessions=None, **ranges) -> pd.DataFrame:
+        '''
+        Function that returns the runs matching the filters
+
+        Inputs :
+        - effort : True for efforts, False for rests, None for both
+        - since, until : bounds (datetime) of the start of the runs
+        - sessions : list of session ids
+        - ranges : (min, max) on the numeric columns, e.g. duration=(25, 35), mean_speed=(4, None)
+
+        Output : a dataframe with one row per run
+        '''
+        mask = self._mask(effort, since, until, sessions, **ranges)
+        df = pd.DataFrame({name: values[mask] for name, values in self._data.items()})
+        df['session'] = np.asarray(self.sessions, dtype=object)[df['session']] if self.sessions else df['session']
+        df['start'] = pd.to_datetime(df['start'], unit='s')
+        df['end'] = pd.to_datetime(df['end'], unit='s')
+        return df
+
+    def aggregate(self, columns=('duration', 'mean_speed', 'mean_hr'), effort=True, since=None, until=None,
+                  sessions=None, **ranges) -> pd.DataFrame:
+        '''
+        Function that aggregates the runs matching the filters per session
+
+        Inputs :
+        - columns : numeric columns to average
+        - the filters of query
+
+        Output : a dataframe with, for each session, the number of runs and the mean of each column
+        (over the runs where the column is known)
+        '''
+        mask = self._mask(effort, since, until, sessions, **ranges)
+        codes = self._data['session'][mask]
+        count = np.bincount(codes, minlength=len(self.sessions))
+        stats = {'session': self.sessions, 'runs': count}
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for name in columns:
+                values = self._data[name][mask].astype(float)
+                # Missing values (e.g. no cadence) are not counted
+                valid = ~np.isnan(values)
+                total = np.bincount(codes, weights=np.nan_to_num(values), minlength=len(self.sessions))
+                stats[name] = total / np.bincount(codes, weights=valid, minlength=len(self.sessions))
+        df = pd.DataFrame(stats)
+        return df[df['runs'] > 0].reset_index(drop=True)
+
+    def save(self):
+        '''
+        Function that saves the index in the catalog
+        '''
+        if self.path is None:
+            raise ValueError("The index has no catalog directory, it can't be saved")
+        self._consolidate()
+        np.savez(self.path, sessions=np.asarray(self.sessions, dtype=str), **self._data)
+
+    def load(self):
+        '''
+        Function that loads the index of the catalog
+        '''
+        with np.load(self.path) as f:
+            self.sessions = f['sessions'].tolist()
+            self._data = {name: f[name] for name in self._empty()}
+        self._codes = {session_id: code for code, session_id in enumerate(self.sessions)}
+        self._chunks = []
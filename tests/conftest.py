@@ -0,0 +1,14 @@
+import os
+import shutil
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+@pytest.fixture
+def fit_file(tmp_path):
+    # Copy of data.fit, so that sidecar files are written in a temporary folder
+    path = tmp_path / "data.fit"
+    shutil.copy(os.path.join(ROOT, "data.fit"), path)
+    return str(path)
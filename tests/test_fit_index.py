@@ -0,0 +1,36 @@
+import pytest
+import fit_index as fi
+import functions as fc
+
+def _same_records(df_window, df_full):
+    # Same values, whatever the dtype (int or float when a column has missing values)
+    assert len(df_window) == len(df_full)
+    for col in df_window.columns:
+        left = df_window[col].astype(object).where(df_window[col].notna(), None).tolist()
+        right = df_full[col].astype(object).where(df_full[col].notna(), None).tolist()
+        assert left == right, col
+
+@pytest.mark.parametrize("first, last", [(0, 10), (100, 300), (499, 501), (1200, 1379)])
+def test_window_matches_full_decode(fit_file, first, last):
+    df_full, _ = fc.import_data_fit(fit_file)
+    timestamps = df_full['timestamp']
+    index = fi.build_fit_index(fit_file, every=50)
+    df_window, df_unit = fi.import_data_fit_window(fit_file, timestamps[first], timestamps[last], index)
+    expected = df_full[(timestamps >= timestamps[first]) & (timestamps <= timestamps[last])].reset_index(drop=True)
+    _same_records(df_window, expected)
+    assert len(df_unit) == len(df_window)
+
+def test_parallel_windows(fit_file):
+    df_full, _ = fc.import_data_fit(fit_file)
+    timestamps = df_full['timestamp']
+    windows = [(timestamps[0], timestamps[200]), (timestamps[900], timestamps[1000])]
+    results = fi.import_data_fit_windows(fit_file, windows, processes=2)
+    for (start, end), (df_window, _) in zip(windows, results):
+        _same_records(df_window, df_full[(timestamps >= start) & (timestamps <= end)].reset_index(drop=True))
+
+def test_index_rebuilt_when_every_changes(fit_file):
+    index = fi.load_fit_index(fit_file, every=100)
+    assert fi.load_fit_index(fit_file, every=100)['every'] == 100
+    rebuilt = fi.load_fit_index(fit_file, every=50)
+    assert rebuilt['every'] == 50
+    assert len(rebuilt['checkpoints']) > len(index['checkpoints'])
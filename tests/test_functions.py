@@ -0,0 +1,211 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import functions as fc
+from conftest import ROOT
+
+def _laps(trigger, intensity=None):
+    # Laps of 60 s from a fixed start
+    start = pd.Timestamp('2025-09-11 16:00:00') + pd.to_timedelta([60 * i for i in range(len(trigger))], unit='s')
+    laps = pd.DataFrame({'start_time': start, 'lap_trigger': trigger})
+    if intensity is not None:
+        laps['intensity'] = intensity
+    return laps
+
+@pytest.fixture(scope='module')
+def session():
+    df_data, _, tables = fc.import_data_fit(os.path.join(ROOT, 'data.fit'), side_tables=True)
+    df_data = df_data.sort_values('timestamp').reset_index(drop=True)
+    df_data['delta_time'] = df_data['timestamp'].diff().dt.total_seconds()
+    return df_data, tables
+
+def test_split_laps_manual():
+    warmup, speed, cooldown = fc.split_laps(_laps(['manual'] * 5 + ['session_end']))
+    assert (len(warmup), len(speed), len(cooldown)) == (1, 4, 1)
+
+def test_split_laps_workout():
+    laps = _laps(['time'] * 6, ['warmup', 'warmup', 'active', 'rest', 'active', 'cooldown'])
+    warmup, speed, cooldown = fc.split_laps(laps)
+    assert (len(warmup), len(speed), len(cooldown)) == (2, 3, 1)
+
+def test_split_laps_automatic_laps_ignored():
+    assert fc.split_laps(_laps(['distance'] * 10 + ['session_end'], ['active'] * 11)) == (None, None, None)
+
+def test_split_session_falls_back_without_usable_laps(session):
+    df_data, tables = session
+    auto_laps = tables['lap'].assign(lap_trigger='distance', intensity=None)
+    parts = fc.split_session(df_data, auto_laps, tables['event'])
+    expected = fc.split_session(df_data, None, None)
+    assert [len(part) for part in parts] == [len(part) for part in expected]
+    # Breaks of more than 80s in the records
+    assert expected[1]['timestamp'].iloc[0] == df_data.loc[df_data['delta_time'] > 80, 'timestamp'].iloc[0]
+
+def test_split_session_manual_laps(session):
+    df_data, tables = session
+    # Without events, the manual laps give the parts
+    _, speed, _ = fc.split_session(df_data, tables['lap'], None)
+    assert speed['timestamp'].iloc[0] >= tables['lap']['start_time'].iloc[1]
+    assert speed['timestamp'].iloc[-1] < tables['lap']['start_time'].iloc[-1]
+
+def test_split_session_prefers_timer_pauses(session):
+    df_data, tables = session
+    # The last manual lap starts before the end of the last effort : the restarts of the timer are used
+    _, speed, cooldown = fc.split_session(df_data, tables['lap'], tables['event'])
+    assert speed['timestamp'].iloc[0] == pd.Timestamp('2025-09-11 17:13:52')
+    assert cooldown['timestamp'].iloc[0] == pd.Timestamp('2025-09-11 17:43:10')
+
+def test_watch_stats_skips_empty_totals():
+    laps = pd.DataFrame({'total_timer_time': [600.0, 300.0], 'total_elapsed_time': [700.0, 300.0],
+                         'total_distance': [2000.0, 1000.0], 'avg_heart_rate': [None, None],
+                         'total_ascent': [None, 5.0], 'total_descent': [3.0, 4.0]})
+    stats = fc.watch_stats(laps, 'total_timer_time')
+    assert stats['Running_time'] == '00:15:00'
+    assert stats['Elevation_loss_m'] == -7.0
+    assert stats['Average_enhanced_speed_m/s'] == 3.33
+    # Empty or missing totals are left to the records
+    assert not {'Average_hr_bpm', 'Max_hr_bpm', 'Elevation_gain_m'} & set(stats)
+
+def test_threshold_sweep_finds_the_workout(session):
+    df_data, tables = session
+    df_data = df_data.assign(time=(df_data['timestamp'] - df_data['timestamp'].iloc[0]).dt.total_seconds() / 60)
+    _, speed, _ = fc.split_session(df_data, tables['lap'], tables['event'])
+    df_sweep, threshold = fc.threshold_sweep(speed, [3.0, 4.0, 5.0, 6.0], effort=30, rest=50)
+    assert threshold in (4.0, 5.0)
+    assert df_sweep.loc[df_sweep['Threshold (m/s)'] == threshold, 'Reps'].item() == 18
+
+def test_threshold_sweep_without_efforts(session):
+    df_data, _ = session
+    df_data = df_data.assign(time=(df_data['timestamp'] - df_data['timestamp'].iloc[0]).dt.total_seconds() / 60)
+    # No speed above the thresholds
+    for effort in (30, None):
+        _, threshold = fc.threshold_sweep(df_data, [10.0, 12.0], effort=effort)
+        assert threshold is None
+
+def test_session_load_needs_athlete_max_hr(session):
+    df_data, _ = session
+    with pytest.raises(ValueError):
+        fc.session_load(df_data)
+    # Same max_hr : a harder session has a higher load
+    easy = df_data.assign(heart_rate=130)
+    hard = df_data.assign(heart_rate=175)
+    assert fc.session_load(hard, max_hr=195) > fc.session_load(easy, max_hr=195)
+
+def test_session_load_pace_based(session):
+    df_data, _ = session
+    no_hr = df_data.drop(columns='heart_rate')
+    with pytest.raises(ValueError):
+        fc.session_load(no_hr)
+    assert fc.session_load(no_hr, threshold_speed=4.0) > 0
+
+def test_resample_session_masks_watch_off_gaps():
+    start = pd.Timestamp('2025-09-11 16:00:00')
+    df = pd.DataFrame({'timestamp': start + pd.to_timedelta([0, 2, 4, 4 + fc.WATCH_OFF_GAP + 10, 6 + fc.WATCH_OFF_GAP + 10], unit='s'),
+                       'heart_rate': [100.0, 110.0, 120.0, 180.0, 180.0]})
+    df_grid = fc.resample_session(df, step=1.0)
+    # Points between two records are interpolated, points of the long break are masked
+    assert df_grid['heart_rate'].iloc[1] == 105.0
+    assert df_grid['gap'].sum() == fc.WATCH_OFF_GAP + 9
+    assert df_grid['delta_time'].sum() == len(df_grid) - df_grid['gap'].sum()
+
+def test_time_weighted_mean_ignores_gaps():
+    values = np.array([1.0, 2.0, np.nan, 100.0, 3.0])
+    valid = np.array([True, True, True, False, True])
+    assert fc.time_weighted_mean(values, valid) == 2.0
+    assert np.isnan(fc.time_weighted_mean(values, np.zeros(5, dtype=bool)))
+
+def test_all_session_stat_weighted_by_time():
+    # Records 1 s then 5 s apart : the 5 s ramp counts five times more than the first second
+    start = pd.Timestamp('2025-09-11 16:00:00')
+    df = pd.DataFrame({'timestamp': start + pd.to_timedelta([0, 1, 6], unit='s'),
+                       'heart_rate': [100.0, 100.0, 200.0], 'distance': [0.0, 3.0, 18.0],
+                       'altitude': [40.0, 40.0, 40.0], 'enhanced_speed': [3.0, 3.0, 3.0],
+                       'speed': [3.0, 3.0, 3.0], 'temperature': [20.0, 20.0, 20.0]})
+    stats = fc.all_session_stat(fc.resample_session(df, step=1.0)).set_index('Metric')['Value']
+    # (100 + 100 + 120 + 140 + 160 + 180 + 200) / 7 = 142.9, the mean of the records is 133.3
+    assert stats['Average_hr_bpm'] == 142
+
+def test_resample_session_bool_columns():
+    start = pd.Timestamp('2025-09-11 16:00:00')
+    df = pd.DataFrame({'timestamp': start + pd.to_timedelta([0, 2, 4 + fc.WATCH_OFF_GAP + 10], unit='s'),
+                       'paused': [False, True, False]})
+    df_grid = fc.resample_session(df.iloc[:2], step=1.0)
+    assert df_grid['paused'].tolist() == [False, False, True]
+    df_grid = fc.resample_session(df, step=1.0)
+    # Missing in the gap, previous record elsewhere
+    assert df_grid['paused'][df_grid['gap']].isna().all()
+    assert not df_grid['paused'].iloc[-1]
+
+def test_rolling_kernels():
+    values = np.array([1.0, 3.0, np.nan, 5.0, 100.0, 2.0])
+    valid = np.array([True, True, True, True, False, True])
+    np.testing.assert_allclose(fc.rolling_mean(values, valid, 2), [1.0, 2.0, 3.0, 5.0, 5.0, 2.0])
+    np.testing.assert_allclose(fc.rolling_max(values, valid, 3), [1.0, 3.0, 3.0, 5.0, 5.0, 5.0])
+    np.testing.assert_allclose(fc.rolling_mean(values, np.zeros(6, dtype=bool), 2), [np.nan] * 6)
+    # Distance (m) from the speed (m/s) on a 2 s grid, without the gap
+    np.testing.assert_allclose(fc.cumulative_integral(values, valid, step=2.0), [2.0, 8.0, 8.0, 18.0, 18.0, 22.0])
+
+def test_interval_runs_blocks():
+    start = pd.Timestamp('2025-09-11 16:00:00')
+    df = pd.DataFrame({'timestamp': start + pd.to_timedelta(np.arange(8), unit='s'),
+                       'enhanced_speed': [1.0, 5.0, 5.0, 1.0, 1.0, 5.0, 6.0, 1.0],
+                       'heart_rate': [100.0, 150.0, 160.5, 120.0, 110.0, 170.0, 180.0, 150.0]})
+    df['time'] = np.arange(8) / 60
+    runs = fc.interval_runs(df, 4.0)
+    # Effort, rest, effort : the rows before the first and after the last effort are left out
+    assert runs['effort'].tolist() == [True, False, True]
+    assert runs['duration'].tolist() == [1.0, 3.0, 1.0]
+    np.testing.assert_allclose(runs['mean_hr'], [155.25, 115.0, 175.0])
+    np.testing.assert_allclose(runs['max_hr'], [160.0, 120.0, 180.0])
+    np.testing.assert_allclose(runs['max_speed'], [5.0, 1.0, 6.0])
+    # The rest goes from the end of the first effort to the start of the second one
+    assert runs['start'].iloc[1] == start + pd.Timedelta(seconds=2)
+    assert runs['end'].iloc[1] == start + pd.Timedelta(seconds=5)
+
+def _recoveries(taus, rest=90, effort=30):
+    # Efforts at 180 bpm followed by exponential decays towards 100 bpm, one sample per second
+    t, hr, rests = [], [], []
+    now = 0
+    for tau in taus:
+        t.extend(now + np.arange(effort))
+        hr.extend([180.0] * effort)
+        now += effort
+        rests.append((now / 60, (now + rest - 1) / 60))
+        t.extend(now + np.arange(rest))
+        hr.extend(100 + 80 * np.exp(-np.arange(rest) / tau))
+        now += rest
+    df = pd.DataFrame({'time': np.array(t) / 60, 'heart_rate': hr})
+    start, end = np.array(rests).T
+    return df, start, end
+
+def test_hr_recovery_finds_tau():
+    df, start, end = _recoveries([20, 40, 60])
+    recovery = fc.hr_recovery(df, start, end)
+    assert np.allclose(recovery['HR_recovery_tau (s)'], [20, 40, 60], atol=1)
+    assert np.allclose(recovery['HR_drop_30s (bpm)'], 80 * (1 - np.exp(-30 / np.array([20, 40, 60]))), atol=0.01)
+
+def test_hr_recovery_short_rests():
+    df, start, end = _recoveries([20, 40], rest=40)
+    recovery = fc.hr_recovery(df, start, end)
+    # Rests shorter than 60 s have no 60 s drop
+    assert recovery['HR_drop_30s (bpm)'].notna().all()
+    assert recovery['HR_drop_60s (bpm)'].isna().all()
+
+def test_hr_recovery_without_heart_rate():
+    df, start, end = _recoveries([20, 40])
+    recovery = fc.hr_recovery(df.assign(heart_rate=np.nan), start, end)
+    assert len(recovery) == 2
+    assert recovery.isna().all().all()
+
+def test_speed_session_stat_matches_interval_runs(session):
+    df_data, tables = session
+    df_data = df_data.assign(time=(df_data['timestamp'] - df_data['timestamp'].iloc[0]).dt.total_seconds() / 60)
+    _, speed, _ = fc.split_session(df_data, tables['lap'], tables['event'])
+    df_intervals_speed, df_intervals_rest = fc.speed_session_stat(speed.copy(), 4.6)
+    runs = fc.interval_runs(speed, 4.6)
+    # The tables of the app and the runs of the index are the same blocks
+    assert len(df_intervals_speed) == runs['effort'].sum()
+    assert len(df_intervals_rest) == (~runs['effort']).sum()
+    assert np.allclose(df_intervals_speed['Max_speed (m/s)'], runs.loc[runs['effort'], 'max_speed'].round(2))
+    assert np.allclose(runs.loc[runs['effort'], 'duration'],
+                       (runs.loc[runs['effort'], 'end_time'] - runs.loc[runs['effort'], 'start_time']) * 60)
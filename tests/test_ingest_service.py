@@ -0,0 +1,111 @@
+import asyncio
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+import ingest_service
+from ingest_service import IngestService, process_file
+
+def _request(service, head, body=b''):
+    # Send one request to handle_http and return the status and the JSON body (read until EOF)
+    async def run():
+        server = await asyncio.start_server(service.handle_http, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(head.encode() + b'\r\n\r\n' + body)
+        await writer.drain()
+        response = await asyncio.wait_for(reader.read(), 5)
+        writer.close()
+        server.close()
+        return response
+    status, _, payload = asyncio.run(run()).partition(b'\r\n\r\n')
+    return int(status.split()[1]), json.loads(payload)
+
+def test_process_file_load_needs_max_hr(fit_file):
+    # Without the max heart rate of the athlete the file is still processed, with no load
+    results = process_file(fit_file)
+    assert results['load'] is None
+    assert 'stats' in results
+    results = process_file(fit_file, max_hr=190)
+    assert results['load'] > 0
+    # The session has manual laps around the intervals : its runs are indexed
+    assert len(results['runs']) > 0
+
+def test_archive_keeps_existing_files(tmp_path):
+    service = IngestService(str(tmp_path / "drop"), str(tmp_path / "catalog"))
+    for content in (b'first', b'second'):
+        path = os.path.join(service.drop, "run.fit")
+        with open(path, 'wb') as f:
+            f.write(content)
+        service._archive(path, 'failed')
+    assert sorted(os.listdir(os.path.join(service.drop, 'failed'))) == ['run.fit', 'run_1.fit']
+
+def test_upload_status_codes(tmp_path, monkeypatch):
+    service = IngestService(str(tmp_path / "drop"), str(tmp_path / "catalog"), queue_size=4)
+    upload = "POST /upload?name={} HTTP/1.1\r\nContent-Length: {}"
+    assert _request(service, upload.format('a.fit', 3), b'abc') == (202, {'queued': 'a.fit', 'queue_depth': 1})
+    assert os.path.exists(os.path.join(service.drop, 'a.fit'))
+    # Same name while the first file is waiting : rejected, the file is not queued twice
+    assert _request(service, upload.format('a.fit', 3), b'xyz')[0] == 409
+    assert service.queue.qsize() == 1
+    assert _request(service, upload.format('a.txt', 3), b'abc')[0] == 400
+    monkeypatch.setattr(ingest_service, 'MAX_UPLOAD', 2)
+    assert _request(service, upload.format('b.fit', 3), b'abc')[0] == 413
+    assert _request(service, "GET /unknown HTTP/1.1")[0] == 404
+
+def test_metrics(tmp_path):
+    service = IngestService(str(tmp_path / "drop"), str(tmp_path / "catalog"))
+    status, metrics = _request(service, "GET /metrics HTTP/1.1")
+    assert status == 200
+    assert metrics['queue_depth'] == 0 and metrics['processed'] == 0 and metrics['latency_mean_s'] is None
+
+def test_bounded_queue_backpressure(tmp_path):
+    service = IngestService(str(tmp_path / "drop"), str(tmp_path / "catalog"), queue_size=1)
+
+    async def run():
+        await service.enqueue('a.fit')
+        # The queue is full : the second file waits
+        second = asyncio.create_task(service.enqueue('b.fit'))
+        await asyncio.sleep(0.05)
+        assert not second.done()
+        assert (await service.queue.get())[0] == 'a.fit'
+        await asyncio.wait_for(second, 1)
+        assert service.queue.qsize() == 1
+    asyncio.run(run())
+
+def test_watch_queues_stable_files(tmp_path, fit_file):
+    service = IngestService(str(tmp_path / "drop"), str(tmp_path / "catalog"), poll=0.01)
+    shutil.copy(fit_file, os.path.join(service.drop, 'run.fit'))
+    open(os.path.join(service.drop, 'notes.txt'), 'w').close()
+
+    async def run():
+        watcher = asyncio.create_task(service.watch())
+        path, _ = await asyncio.wait_for(service.queue.get(), 5)
+        await asyncio.sleep(0.05)
+        watcher.cancel()
+        return path
+    assert asyncio.run(run()) == os.path.join(service.drop, 'run.fit')
+    # Queued once, the other files are ignored
+    assert service.queue.qsize() == 0
+
+def test_worker_survives_archive_errors(tmp_path, monkeypatch):
+    service = IngestService(str(tmp_path / "drop"), str(tmp_path / "catalog"))
+    def fail(*args):
+        raise ValueError("not a FIT file")
+    def archive(path, folder):
+        raise OSError("disk full")
+    monkeypatch.setattr(ingest_service, 'process_file', fail)
+    monkeypatch.setattr(service, '_archive', archive)
+
+    async def run():
+        with ThreadPoolExecutor(1) as pool:
+            worker = asyncio.create_task(service.worker(pool))
+            for name in ('a.fit', 'b.fit'):
+                await service.enqueue(os.path.join(service.drop, name))
+            await asyncio.wait_for(service.queue.join(), 5)
+            assert not worker.done()
+            worker.cancel()
+    asyncio.run(run())
+    assert service.failed == 2
+    # Files that could not be moved stay pending, they are not queued again
+    assert len(service._pending) == 2
@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+import pytest
+from interval_index import IntervalIndex
+
+def _runs(n, start='2025-09-11 17:00:00', **values):
+    # n efforts of 30 s every 80 s
+    start = pd.Timestamp(start) + pd.to_timedelta(np.arange(n) * 80, unit='s')
+    runs = pd.DataFrame({'effort': True, 'start': start, 'end': start + pd.Timedelta(seconds=30), 'duration': 30.0,
+                         'mean_speed': 5.0, 'max_speed': 6.0, 'mean_hr': 170.0, 'max_hr': 180.0,
+                         'cadence': 90.0, 'step_length': 1800.0})
+    for name, value in values.items():
+        runs[name] = value
+    return runs
+
+def test_query_and_replace():
+    index = IntervalIndex()
+    index.add_session('a', _runs(4))
+    index.add_session('b', _runs(3, mean_speed=[3.0, 4.5, 5.0]))
+    assert len(index.query(mean_speed=(4, None))) == 6
+    assert len(index.query(sessions=['b'], mean_speed=(4, None))) == 2
+    index.add_session('a', _runs(2))
+    assert len(index) == 5
+
+def test_aggregate_ignores_missing_values():
+    index = IntervalIndex()
+    index.add_session('a', _runs(3, mean_hr=[160.0, np.nan, 170.0], cadence=np.nan))
+    df = index.aggregate(columns=('mean_hr', 'cadence', 'duration'))
+    assert df['runs'].item() == 3
+    assert df['mean_hr'].item() == pytest.approx(165.0)
+    assert np.isnan(df['cadence'].item())
+    assert df['duration'].item() == pytest.approx(30.0)
+
+def test_save_and_load(tmp_path):
+    index = IntervalIndex(str(tmp_path))
+    index.add_session('a', _runs(4))
+    index.save()
+    loaded = IntervalIndex(str(tmp_path))
+    assert loaded.sessions == ['a']
+    pd.testing.assert_frame_equal(loaded.query(), index.query())
+
+def test_save_without_catalog():
+    with pytest.raises(ValueError):
+        IntervalIndex().save()
@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import pytest
+from training_load import TrainingLoad
+
+def _recompute(sessions, atl_days=7, ctl_days=42):
+    # Day by day recompute over the full history
+    first = min(day for day, _ in sessions.values())
+    last = max(day for day, _ in sessions.values())
+    load = np.zeros((last - first).days + 1)
+    for day, value in sessions.values():
+        load[(day - first).days] += value
+    series = {}
+    for name, days in (('ATL', atl_days), ('CTL', ctl_days)):
+        a, x, values = np.exp(-1 / days), 0.0, []
+        for value in load:
+            x = a * x + (1 - a) * value
+            values.append(x)
+        series[name] = np.array(values)
+    return series
+
+def test_incremental_matches_recompute():
+    rng = np.random.default_rng(0)
+    days = pd.Timestamp('2025-01-01') + pd.to_timedelta(rng.integers(0, 200, 60), unit='D')
+    loads = rng.uniform(20, 200, 60)
+    timeline = TrainingLoad()
+    sessions = {}
+    # Added in random order : many backfills
+    for i, (day, load) in enumerate(zip(days, loads)):
+        timeline.add_session(f's{i}', day, load)
+        sessions[f's{i}'] = (day, load)
+    # Replacement and removal
+    timeline.add_session('s5', days[5], 10.0)
+    sessions['s5'] = (days[5], 10.0)
+    timeline.remove_session('s7')
+    del sessions['s7']
+
+    expected = _recompute(sessions)
+    df = timeline.timeline()
+    np.testing.assert_allclose(df['ATL'], expected['ATL'], atol=1e-9)
+    np.testing.assert_allclose(df['CTL'], expected['CTL'], atol=1e-9)
+    np.testing.assert_allclose(df['TSB'], expected['CTL'] - expected['ATL'], atol=1e-9)
+
+def test_save_and_load(tmp_path):
+    timeline = TrainingLoad(str(tmp_path))
+    timeline.add_session('a', '2025-09-01', 100)
+    timeline.add_session('b', '2025-09-05', 50)
+    timeline.save()
+    pd.testing.assert_frame_equal(TrainingLoad(str(tmp_path)).timeline(), timeline.timeline())
+
+def test_load_with_other_constants(tmp_path):
+    timeline = TrainingLoad(str(tmp_path))
+    timeline.add_session('a', '2025-09-01', 100)
+    timeline.save()
+    with pytest.raises(ValueError):
+        TrainingLoad(str(tmp_path), atl_days=5)
+
+def test_new_days_grow_capacity_geometrically():
+    timeline = TrainingLoad()
+    capacities = set()
+    sessions = {}
+    for i, day in enumerate(pd.date_range('2025-01-01', periods=1000)):
+        timeline.add_session(f's{i}', day, 50.0)
+        sessions[f's{i}'] = (day, 50.0)
+        capacities.add(len(timeline.series['atl']))
+    # A few reallocations, not one copy of the history per day
+    assert len(capacities) <= 12
+    assert len(timeline.timeline()) == 1000
+    expected = _recompute(sessions)
+    np.testing.assert_allclose(timeline.timeline()['CTL'], expected['CTL'], atol=1e-9)
@@ -0,0 +1,144 @@
+import os
+import numpy as np
+import pandas as pd
+
+class TrainingLoad:
+    '''
+    Daily training load timeline of a catalog : acute load (ATL), chronic load (CTL)
+    and training stress balance (TSB = CTL - ATL)
+
+    ATL and CTL are exponentially weighted averages of the daily load :
+    X[t] = a * X[t-1] + (1 - a) * load[t], with a = exp(-1 / days).
+    They are linear in the loads, so a session of load L on day d adds
+    (1 - a) * L * a^(t - d) to every day t >= d. Adding a new session only updates
+    the last days, and a backfill only updates the days after the old session.
+    The daily series are preallocated and their capacity doubles when it is full,
+    so that a new day does not copy the whole history.
+    The timeline is saved in the catalog directory as 'training_load.npz'.
+    '''
+
+    def __init__(self, catalog: str = None, atl_days: float = 7, ctl_days: float = 42):
+        '''
+        Inputs :
+        - catalog : directory of the catalog (None for a timeline in memory only),
+        the existing timeline of the catalog is loaded
+        - atl_days, ctl_days : time constants (days) of the acute and chronic loads
+        '''
+        self.path = os.path.join(catalog, 'training_load.npz') if catalog else None
+        self.days = {'atl': atl_days, 'ctl': ctl_days}
+        self.decay = {'atl': np.exp(-1 / atl_days), 'ctl': np.exp(-1 / ctl_days)}
+        # First day of the timeline, daily series (the first n days of the arrays are used)
+        self.start = None
+        self.n = 0
+        self.series = {'load': np.empty(0), 'atl': np.empty(0), 'ctl': np.empty(0)}
+        # Day and load of each session
+        self.sessions = {}
+        if self.path and os.path.exists(self.path):
+            self.load()
+
+    def _cover(self, day: np.datetime64):
+        # Extend the daily series so that they contain the day
+        if self.start is None:
+            self.start = day
+        if day < self.start:
+            # No load before the first day : zeros (a backfill before the timeline copies it once)
+            n = int((self.start - day) / np.timedelta64(1, 'D'))
+            self.series = {name: np.concatenate([np.zeros(n), values[:self.n]]) for name, values in self.series.items()}
+            self.start = day
+            self.n += n
+        n = int((day - self.start) / np.timedelta64(1, 'D')) + 1 - self.n
+        if n > 0:
+            # Capacity doubled when the arrays are full
+            if self.n + n > len(self.series['load']):
+                capacity = max(self.n + n, 2 * len(self.series['load']))
+                for name, values in self.series.items():
+                    self.series[name] = np.zeros(capacity)
+                    self.series[name][:self.n] = values[:self.n]
+            # The loads decay during the days without session
+            self.series['load'][self.n:self.n + n] = 0.0
+            for name in self.decay:
+                last = self.series[name][self.n - 1] if self.n else 0.0
+                self.series[name][self.n:self.n + n] = last * self.decay[name]**np.arange(1, n + 1)
+            self.n += n
+
+    def _apply(self, day: np.datetime64, load: float):
+        # Add the contribution of a load on a day to the days after it
+        self._cover(day)
+        i = int((day - self.start) / np.timedelta64(1, 'D'))
+        self.series['load'][i] += load
+        for name, a in self.decay.items():
+            self.series[name][i:self.n] += (1 - a) * load * a**np.arange(self.n - i)
+
+    def add_session(self, session_id: str, date, load: float):
+        '''
+        Function that adds (or replaces) the load of a session
+
+        Inputs :
+        - session_id : identifier of the session
+        - date : date of the session
+        - load : training load of the session (e.g. functions.session_load)
+        '''
+        session_id = str(session_id)
+        if session_id in self.sessions:
+            self.remove_session(session_id)
+        day = np.datetime64(pd.Timestamp(date).date(), 'D')
+        self._apply(day, load)
+        self.sessions[session_id] = (day, float(load))
+
+    def remove_session(self, session_id: str):
+        '''
+        Function that removes the load of a session
+        '''
+        day, load = self.sessions.pop(str(session_id))
+        self._apply(day, -load)
+
+    def timeline(self, until=None) -> pd.DataFrame:
+        '''
+        Function that returns the daily timeline
+
+        Input : until : last day of the timeline (to see the decay after the last session), None for the last session
+        Output : a dataframe with the date, the daily load, ATL, CTL and TSB
+        '''
+        if until is not None:
+            self._cover(np.datetime64(pd.Timestamp(until).date(), 'D'))
+        n = self.n
+        dates = self.start + np.arange(n) if n else np.empty(0, dtype='datetime64[D]')
+        df = pd.DataFrame({
+            'date': dates,
+            'load': self.series['load'][:n],
+            'ATL': self.series['atl'][:n],
+            'CTL': self.series['ctl'][:n]
+        })
+        df['TSB'] = df['CTL'] - df['ATL']
+        return df
+
+    def save(self):
+        '''
+        Function that saves the timeline in the catalog
+        '''
+        if self.path is None:
+            raise ValueError("The timeline has no catalog directory, it can't be saved")
+        ids = list(self.sessions)
+        np.savez(self.path,
+                 atl_days=self.days['atl'],
+                 ctl_days=self.days['ctl'],
+                 start=np.array([self.start if self.start is not None else np.datetime64('NaT')], dtype='datetime64[D]'),
+                 session_ids=np.asarray(ids, dtype=str),
+                 session_days=np.array([self.sessions[i][0] for i in ids], dtype='datetime64[D]'),
+                 session_loads=np.array([self.sessions[i][1] for i in ids], dtype=float),
+                 **{name: values[:self.n] for name, values in self.series.items()})
+
+    def load(self):
+        '''
+        Function that loads the timeline of the catalog (built with the same time constants)
+        '''
+        with np.load(self.path) as f:
+            saved = {'atl': float(f['atl_days']), 'ctl': float(f['ctl_days'])}
+            if saved != {name: float(days) for name, days in self.days.items()}:
+                raise ValueError(f"The timeline of the catalog was built with atl_days={saved['atl']} and "
+                                 f"ctl_days={saved['ctl']}, not {self.days['atl']} and {self.days['ctl']}")
+            start = f['start'][0]
+            self.start = None if np.isnat(start) else start
+            self.series = {name: f[name] for name in self.series}
+            self.n = len(self.series['load'])
+            self.sessions = {i: (day, float(load)) for i, day, load in zip(f['session_ids'].tolist(), f['session_days'], f['session_loads'])}